@@ -1,51 +1,68 @@
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-# Load env from parent directory if needed, or current
-load_dotenv()
-
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-
-if not url or not key:
-    print("Error: SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY not found in environment.")
-    exit(1)
-
-supabase: Client = create_client(url, key)
-
-sql = "ALTER TABLE events ADD COLUMN IF NOT EXISTS meeting_link text;"
-
-try:
-    # Supabase-py doesn't support raw SQL directly on the client easily unless via rpc, 
-    # but we can try to use the postgrest client or just use a workaround if we had a stored proc.
-    # However, for schema changes, usually we use the dashboard or a migration tool.
-    # But wait, 'supabase_schema.sql' exists, so maybe the user runs it manually?
-    # The user asked me to "integrate", implying I should do it.
-    # If I can't run raw SQL, I might need to create a function via SQL editor... but I can't access SQL editor.
-    # Wait, I can try to use `supabase.rpc` if there is a function to run sql? Unlikely.
-    # Actually, the user has `backend/supabase_schema.sql`. I should probably update that file too.
-    # AND I should try to apply it.
-    
-    # If I cannot run raw SQL from here, I might have to assume the user has to do it or I use a workaround.
-    # But often users have a `run_sql` function or similar if they are advanced.
-    # Start with updating schema.sql.
-    
-    # Actually, in `calendar_sync.py` they use `supabase.table(...)`.
-    # I'll check if I can just assume the column exists for now? No, that will error.
-    
-    # Let's try to see if there is a way to run it.
-    # If not, I will create a function `exec_sql` if I can? No.
-    
-    # Alternative: Use `psycopg2` if available? 
-    # Let's check requirements.txt.
-    pass
-except Exception as e:
-    print(f"Error: {e}")
-
-# Re-evaluating: getting raw SQL access is hard with just supabase-js/py client if not configured.
-# However, I can update the schema file and ask the user to run it OR
-# I can try to see if `verify_settings.py` does anything special.
-# Let's check `backend/requirements.txt` first.
-
-print("Schema update script prepared (Manual run might be needed if no raw SQL access).")
+import sys
+from collections import defaultdict
+
+# Backfill events.meeting_link for rows synced before link extraction existed
+# (or before a provider was supported).
+# Usage: python add_meeting_link.py [--dry-run]
+# The column itself comes from supabase_schema.sql.
+
+# Load .env manually
+env_path = os.path.join(os.path.dirname(__file__), '.env')
+if os.path.exists(env_path):
+    with open(env_path, 'r') as f:
+        for line in f:
+            if '=' in line and not line.startswith('#'):
+                key, val = line.strip().split('=', 1)
+                os.environ[key] = val
+
+from services.supabase_client import supabase
+from services import meeting_links
+from services.postgrest import PAGE_SIZE, chunks
+
+
+def backfill_meeting_links(dry_run=False):
+    print("Backfilling meeting links for events without one...")
+    scanned = 0
+    found = 0
+    last_id = None
+
+    while True:
+        # Keyset paging on id: rows that get a link drop out of the filter, so offsets would skip rows
+        query = supabase.table("events").select("id, description, location").is_("meeting_link", "null")
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(PAGE_SIZE).execute().data or []
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        scanned += len(rows)
+
+        # Recurring instances share a description, so group by link and update each group at once
+        ids_by_link = defaultdict(list)
+        for row in rows:
+            link = meeting_links.from_text(row.get("description"), row.get("location"))
+            if link:
+                ids_by_link[link].append(row["id"])
+
+        for link, ids in ids_by_link.items():
+            found += len(ids)
+            if dry_run:
+                print(f"  {len(ids)} event(s) -> {link}")
+                continue
+            for chunk in chunks(ids):
+                supabase.table("events").update({"meeting_link": link}).in_("id", chunk).execute()
+
+        if len(rows) < PAGE_SIZE:
+            break
+
+    action = "would be updated" if dry_run else "updated"
+    print(f"Scanned {scanned} events, {found} {action}.")
+
+
+if __name__ == "__main__":
+    try:
+        backfill_meeting_links(dry_run="--dry-run" in sys.argv)
+    except Exception as e:
+        print(f"Error during backfill: {e}")
+        sys.exit(1)
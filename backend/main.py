@@ -1,11 +1,22 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import auth, calendar_sync, reminders
+from services.sync_scheduler import scheduler, SYNC_SCHEDULER_ENABLED
+from services.read_cache import read_cache
 
-app = FastAPI(title="Alarm Smart Calendar API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background Google sync (opt-in, see services/sync_scheduler.py)
+    if SYNC_SCHEDULER_ENABLED:
+        scheduler.start()
+    yield
+    scheduler.stop()
+
+app = FastAPI(title="Alarm Smart Calendar API", lifespan=lifespan)
 
 # CORS Setup
 app.add_middleware(
@@ -14,12 +25,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"], # Read by the app for If-None-Match polling
 )
 
 @app.get("/")
 def read_root():
     return {"message": "Alarm Smart Calendar Backend is Running"}
 
+@app.get("/cache-stats")
+def cache_stats():
+    # Read cache counters (hits/misses/evictions/invalidations) of this process
+    return read_cache.stats()
+
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
 app.include_router(calendar_sync.router, prefix="/calendar", tags=["Calendar"])
 app.include_router(reminders.router, prefix="/reminders", tags=["Reminders"])
@@ -0,0 +1,6 @@
+-- Add sync_token column to connected_accounts to support incremental Google sync
+ALTER TABLE public.connected_accounts 
+ADD COLUMN IF NOT EXISTS sync_token text;
+
+-- Comment: Stores Google's nextSyncToken from the last successful sync.
+-- If it is NULL, the next sync is a full sync from the start of today.
@@ -0,0 +1,6 @@
+-- Add content_hash column to events so sync only rewrites rows that changed
+ALTER TABLE public.events 
+ADD COLUMN IF NOT EXISTS content_hash text;
+
+-- Comment: SHA-1 of the synced columns (title, times, location, links...).
+-- Rows with a NULL hash (synced before this migration) are rewritten once.
@@ -0,0 +1,80 @@
+-- sync_bootstrap: the whole /calendar/fetch-from-google prelude in one round trip.
+-- Called via PostgREST RPC: supabase.rpc("sync_bootstrap", {...})
+--
+-- 1. Ensures public.users has the user (events.user_id FK), like the old "self-healing" upserts.
+-- 2. If p_email is given (the session token's account):
+--      - inserts it into connected_accounts if it does not exist,
+--      - updates tokens if it exists and is active (NULL params keep the stored value),
+--      - never reactivates a disconnected (is_active = false) account.
+-- 3. Returns the active accounts and the resolved session account:
+--      { "accounts": [...], "primary_account_id": uuid, "primary_is_active": bool }
+
+create or replace function public.sync_bootstrap(
+  p_user_id uuid,
+  p_email text default null,
+  p_access_token text default null,
+  p_refresh_token text default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_user_email text;
+  v_primary_id uuid;
+  v_primary_active boolean;
+begin
+  v_user_email := coalesce(
+    p_email,
+    (select email from connected_accounts
+      where user_id = p_user_id and is_active is not false
+      order by created_at limit 1)
+  );
+
+  if v_user_email is not null then
+    begin
+      insert into users (id, email) values (p_user_id, v_user_email)
+      on conflict (id) do update set email = excluded.email;
+    exception when others then
+      -- Same as before: a failed self-heal must not block the sync
+      raise notice 'sync_bootstrap: users upsert failed: %', sqlerrm;
+    end;
+  end if;
+
+  if p_email is not null then
+    select id, is_active into v_primary_id, v_primary_active
+      from connected_accounts
+      where user_id = p_user_id and email = p_email
+      limit 1;
+
+    if v_primary_id is null then
+      insert into connected_accounts (user_id, email, access_token, refresh_token, is_active, updated_at)
+      values (p_user_id, p_email, p_access_token, p_refresh_token, true, now())
+      returning id into v_primary_id;
+      v_primary_active := true;
+    elsif v_primary_active is not false then
+      update connected_accounts set
+        access_token = coalesce(p_access_token, access_token),
+        -- A session token's expiry is unknown
+        token_expires_at = case when p_access_token is null then token_expires_at else null end,
+        refresh_token = coalesce(p_refresh_token, refresh_token),
+        updated_at = now()
+      where id = v_primary_id;
+    end if;
+  end if;
+
+  return jsonb_build_object(
+    'accounts', coalesce(
+      (select jsonb_agg(to_jsonb(a) order by a.created_at)
+         from connected_accounts a
+        where a.user_id = p_user_id and a.is_active is not false),
+      '[]'::jsonb),
+    'primary_account_id', v_primary_id,
+    'primary_is_active', coalesce(v_primary_active, true)
+  );
+end;
+$$;
+
+-- Backend only (service role); not callable by app users directly
+revoke execute on function public.sync_bootstrap(uuid, text, text, text) from public, anon, authenticated;
@@ -0,0 +1,14 @@
+-- Google Calendar push notifications (events.watch) per connected account
+ALTER TABLE public.connected_accounts
+ADD COLUMN IF NOT EXISTS watch_channel_id text,
+ADD COLUMN IF NOT EXISTS watch_resource_id text,
+ADD COLUMN IF NOT EXISTS watch_token text,
+ADD COLUMN IF NOT EXISTS watch_expires_at timestamptz;
+
+-- /calendar/webhook looks accounts up by the X-Goog-Channel-ID header
+CREATE UNIQUE INDEX IF NOT EXISTS connected_accounts_watch_channel_id_idx
+ON public.connected_accounts (watch_channel_id)
+WHERE watch_channel_id IS NOT NULL;
+
+-- Comment: watch_token is the secret Google echoes back in X-Goog-Channel-Token.
+-- All four columns are NULL when the account has no active channel.
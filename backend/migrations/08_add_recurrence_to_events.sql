@@ -0,0 +1,21 @@
+-- Recurring-event masters (SYNC_RECURRENCE_MASTERS=true, see services/recurrence.py)
+ALTER TABLE public.events
+ADD COLUMN IF NOT EXISTS recurrence text[],
+ADD COLUMN IF NOT EXISTS recurrence_end timestamptz,
+ADD COLUMN IF NOT EXISTS recurring_event_id text,
+ADD COLUMN IF NOT EXISTS original_start_time timestamptz,
+ADD COLUMN IF NOT EXISTS is_cancelled boolean NOT NULL DEFAULT false;
+
+-- Masters of a user, and the exception rows of a series
+CREATE INDEX IF NOT EXISTS events_user_masters_idx
+ON public.events (user_id, start_time)
+WHERE recurrence IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS events_recurring_event_id_idx
+ON public.events (user_id, recurring_event_id)
+WHERE recurring_event_id IS NOT NULL;
+
+-- Comment: recurrence holds RFC 5545 lines (DTSTART first) of a series master.
+-- Exception rows (modified or cancelled instances) carry recurring_event_id and original_start_time.
+-- Switching SYNC_RECURRENCE_MASTERS on or off needs one full sync per account:
+-- UPDATE public.connected_accounts SET sync_token = NULL;
@@ -0,0 +1,27 @@
+-- user_data_version: a cheap fingerprint of everything /calendar/events and
+-- /reminders/upcoming read for a user. Used for ETag / If-None-Match (304) checks.
+-- Called via PostgREST RPC: supabase.rpc("user_data_version", {"p_user_id": ...})
+--
+-- Changes whenever an event is written (updated_at) or deleted (count), an
+-- account is linked or disconnected, or the alarm settings are saved.
+
+create or replace function public.user_data_version(p_user_id uuid)
+returns text
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  select concat_ws('|',
+    (select count(*) || ':' || coalesce(max(updated_at)::text, '') from public.events where user_id = p_user_id),
+    (select count(*) || ':' || coalesce(max(updated_at)::text, '') from public.connected_accounts where user_id = p_user_id),
+    (select coalesce(max(updated_at)::text, '') from public.alarm_settings where user_id = p_user_id)
+  );
+$$;
+
+-- Keeps the events part an index-only scan
+CREATE INDEX IF NOT EXISTS events_user_updated_at_idx
+ON public.events (user_id, updated_at);
+
+-- Backend only (service role); not callable by app users directly
+revoke execute on function public.user_data_version(uuid) from public, anon, authenticated;
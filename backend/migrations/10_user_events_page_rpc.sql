@@ -0,0 +1,62 @@
+-- user_events_page: one page of /calendar/events, de-duplicated in the database.
+-- Called via PostgREST RPC: supabase.rpc("user_events_page", {...})
+--
+-- The same Google event can be stored once per connected account (e.g. a
+-- meeting both accounts are invited to). DISTINCT ON keeps one row per
+-- google_event_id (the earliest start, then the lowest id), then the rows are
+-- returned in (start_time, id) order after the keyset cursor.
+-- Series masters and cancelled instances (migrations/08) are never returned;
+-- masters are expanded by the backend.
+-- Needs migrations/08 (recurrence, is_cancelled), even with SYNC_RECURRENCE_MASTERS
+-- off: apply 08 first, or creating the function fails. Without this function the
+-- backend falls back to a table query.
+
+create or replace function public.user_events_page(
+  p_user_id uuid,
+  p_account_ids uuid[],
+  p_from timestamptz,
+  p_until timestamptz,
+  p_after_start timestamptz default null,
+  p_after_id uuid default null,
+  p_limit int default 200
+)
+returns table (
+  id uuid,
+  google_event_id text,
+  account_id uuid,
+  title text,
+  start_time timestamptz,
+  end_time timestamptz,
+  location text,
+  meeting_link text
+)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  select d.id, d.google_event_id, d.account_id, d.title, d.start_time, d.end_time, d.location, d.meeting_link
+  from (
+    select distinct on (e.google_event_id)
+      e.id, e.google_event_id, e.account_id, e.title, e.start_time, e.end_time, e.location, e.meeting_link
+    from public.events e
+    where e.user_id = p_user_id
+      and e.account_id = any(p_account_ids)
+      and e.start_time >= p_from
+      and e.start_time <= p_until
+      and e.recurrence is null
+      and not e.is_cancelled
+    order by e.google_event_id, e.start_time, e.id
+  ) d
+  where p_after_start is null
+     or (d.start_time, d.id) > (p_after_start, coalesce(p_after_id, '00000000-0000-0000-0000-000000000000'::uuid))
+  order by d.start_time, d.id
+  limit p_limit;
+$$;
+
+-- Range scans of a user's events by start time (this RPC, reminders, the sync's deletion pass)
+CREATE INDEX IF NOT EXISTS events_user_start_time_idx
+ON public.events (user_id, start_time);
+
+-- Backend only (service role); not callable by app users directly
+revoke execute on function public.user_events_page(uuid, uuid[], timestamptz, timestamptz, timestamptz, uuid, int) from public, anon, authenticated;
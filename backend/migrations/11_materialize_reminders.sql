@@ -0,0 +1,54 @@
+-- Materialized reminders (see services/reminder_store.py)
+-- One row per (event, occurrence start, offset), written when events sync,
+-- per-event reminder_offsets change or alarm_settings change.
+-- Reads the series columns of migrations/08 (masters are expanded into one row
+-- per instance); they are added here too, so this works with or without 08
+-- and with SYNC_RECURRENCE_MASTERS off.
+ALTER TABLE public.events
+ADD COLUMN IF NOT EXISTS recurrence text[],
+ADD COLUMN IF NOT EXISTS recurrence_end timestamptz,
+ADD COLUMN IF NOT EXISTS recurring_event_id text,
+ADD COLUMN IF NOT EXISTS original_start_time timestamptz,
+ADD COLUMN IF NOT EXISTS is_cancelled boolean NOT NULL DEFAULT false;
+
+ALTER TABLE public.reminders
+ADD COLUMN IF NOT EXISTS occurrence_start timestamptz,
+ADD COLUMN IF NOT EXISTS minutes_before int,
+ADD COLUMN IF NOT EXISTS updated_at timestamptz default now();
+
+-- Re-materializing inserts with ON CONFLICT DO NOTHING, so dismissed rows survive
+CREATE UNIQUE INDEX IF NOT EXISTS reminders_event_occurrence_offset_idx
+ON public.reminders (event_id, occurrence_start, minutes_before);
+
+-- /reminders/upcoming: due, not dismissed reminders of a user
+CREATE INDEX IF NOT EXISTS reminders_user_time_idx
+ON public.reminders (user_id, reminder_time)
+WHERE NOT is_dismissed;
+
+CREATE INDEX IF NOT EXISTS reminders_user_occurrence_idx
+ON public.reminders (user_id, occurrence_start);
+
+-- How far ahead a user's reminders are materialized; readers roll it forward
+ALTER TABLE public.users
+ADD COLUMN IF NOT EXISTS reminders_until timestamptz;
+
+-- Dismissing a reminder must change the ETag of /reminders/upcoming (migrations/09)
+create or replace function public.user_data_version(p_user_id uuid)
+returns text
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  select concat_ws('|',
+    (select count(*) || ':' || coalesce(max(updated_at)::text, '') from public.events where user_id = p_user_id),
+    (select count(*) || ':' || coalesce(max(updated_at)::text, '') from public.connected_accounts where user_id = p_user_id),
+    (select coalesce(max(updated_at)::text, '') from public.alarm_settings where user_id = p_user_id),
+    (select count(*) || ':' || coalesce(max(updated_at)::text, '') from public.reminders where user_id = p_user_id)
+  );
+$$;
+
+CREATE INDEX IF NOT EXISTS reminders_user_updated_at_idx
+ON public.reminders (user_id, updated_at);
+
+revoke execute on function public.user_data_version(uuid) from public, anon, authenticated;
@@ -0,0 +1,25 @@
+-- set_event_reminder_offsets: per-event reminder overrides for many events in one statement.
+-- Called via PostgREST RPC: supabase.rpc("set_event_reminder_offsets", {...})
+--
+-- p_updates is a JSON array of {"id": <events.id>, "reminder_offsets": [minutes, ...]}
+-- (PUT /reminders/events). Rows of other users are never touched. Returns the
+-- updated rows, which the backend re-materializes reminders for.
+
+create or replace function public.set_event_reminder_offsets(p_user_id uuid, p_updates jsonb)
+returns setof public.events
+language sql
+volatile
+security definer
+set search_path = public
+as $$
+  update public.events e
+  set reminder_offsets = u.reminder_offsets,
+      updated_at = now()
+  from jsonb_to_recordset(p_updates) as u(id uuid, reminder_offsets int[])
+  where e.id = u.id
+    and e.user_id = p_user_id
+  returning e.*;
+$$;
+
+-- Backend only (service role); not callable by app users directly
+revoke execute on function public.set_event_reminder_offsets(uuid, jsonb) from public, anon, authenticated;
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from pydantic import BaseModel
 import os
-import requests
 import urllib.parse
 from services.supabase_client import supabase
+from services import http_client, token_store, google_sync, identity_cache, watch_channels
+from services.read_cache import read_cache
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -54,7 +55,7 @@ def disconnect_google_account(req: DisconnectRequest):
     print(f"Received disconnect request for {req_email} (User: {req.user_id})")
     try:
         # 1. Get Account ID
-        acc_resp = supabase.table("connected_accounts").select("id").eq("user_id", req.user_id).eq("email", req_email).execute()
+        acc_resp = supabase.table("connected_accounts").select("*").eq("user_id", req.user_id).eq("email", req_email).execute()
         
         if acc_resp.data:
             acc_id = acc_resp.data[0]['id']
@@ -63,12 +64,24 @@ def disconnect_google_account(req: DisconnectRequest):
             # 2. Delete Events (Hard Delete Events so they are gone)
             supabase.table("events").delete().eq("account_id", acc_id).execute()
             
-            # 3. Soft Delete Account (Set is_active = False)
+            # 3. Stop push notifications while the token still works
+            watch_channels.stop_channel(acc_resp.data[0], clear=False)
+
+            # 4. Soft Delete Account (Set is_active = False)
+            # Clear sync_token so a later reconnect starts with a full sync
             response = supabase.table("connected_accounts").update({
                 "is_active": False,
+                "sync_token": None,
+                **watch_channels.CLEARED_COLUMNS,
                 "updated_at": datetime.utcnow().isoformat()
             }).eq("id", acc_id).execute()
             
+            token_store.forget(acc_id)
+            identity_cache.forget_account(acc_id)
+            # Don't serve a sync result from before the disconnect
+            google_sync.user_sync_flight.forget(lambda key: key[0] == req.user_id)
+            read_cache.invalidate(req.user_id)
+            
             if response.data:
                 return {"message": "Account disconnected and events removed successfully"}
             else:
@@ -112,16 +125,25 @@ def google_callback(code: str, state: str):
         "grant_type": "authorization_code"
     }
     
-    resp = requests.post(token_url, data=data)
+    try:
+        resp = http_client.post(token_url, data=data, retry=False) # A code can only be exchanged once
+    except Exception as e:
+        print(f"Token exchange failed: {e}")
+        return {"error": "Failed to exchange token", "details": str(e)}
     if resp.status_code != 200:
         return {"error": "Failed to exchange token", "details": resp.text}
     
     token_data = resp.json()
     access_token = token_data.get('access_token')
     refresh_token = token_data.get('refresh_token') 
+    expires_at = token_store.expiry_from(token_data.get('expires_in'))
     
     # Get User Info
-    user_info_resp = requests.get("https://www.googleapis.com/oauth2/v2/userinfo", headers={'Authorization': f'Bearer {access_token}'})
+    try:
+        user_info_resp = http_client.get("https://www.googleapis.com/oauth2/v2/userinfo", headers={'Authorization': f'Bearer {access_token}'})
+    except Exception as e:
+        print(f"User info lookup failed: {e}")
+        return {"error": "Failed to fetch user info"}
     if user_info_resp.status_code != 200:
         return {"error": "Failed to fetch user info"}
         
@@ -143,20 +165,38 @@ def google_callback(code: str, state: str):
         "user_id": user_id,
         "email": user_email,
         "access_token": access_token,
+        "token_expires_at": expires_at.isoformat() if expires_at else None,
         "provider": "google",
         "is_active": True, 
+        "sync_token": None, # Force a full sync after (re)linking
         "updated_at": datetime.utcnow().isoformat()
     }
     
     if refresh_token:
         db_data["refresh_token"] = refresh_token
 
-    existing = supabase.table('connected_accounts').select('id').eq('user_id', user_id).eq('email', user_email).execute()
+    existing = supabase.table('connected_accounts').select('id, watch_channel_id, watch_resource_id, watch_expires_at').eq('user_id', user_id).eq('email', user_email).execute()
     
     if existing.data:
-        supabase.table('connected_accounts').update(db_data).eq('id', existing.data[0]['id']).execute()
+        account_id = existing.data[0]['id']
+        supabase.table('connected_accounts').update(db_data).eq('id', account_id).execute()
     else:
-        supabase.table('connected_accounts').insert(db_data).execute()
+        insert_resp = supabase.table('connected_accounts').insert(db_data).execute()
+        account_id = insert_resp.data[0]['id'] if insert_resp.data else None
+
+    # Seed the token cache so the first sync does not need to refresh
+    token_store.remember(account_id, access_token, expires_at)
+    identity_cache.forget_account(account_id) # Relinked: drop identities resolved before
+    # The next sync must include the newly linked account
+    google_sync.user_sync_flight.forget(lambda key: key[0] == user_id)
+    read_cache.invalidate(user_id) # The account map changed
+
+    # Push notifications for the account (no-op unless GOOGLE_WEBHOOK_URL is set)
+    if account_id:
+        try:
+            watch_channels.ensure_channel({**(existing.data[0] if existing.data else {}), **db_data, "id": account_id})
+        except Exception as e:
+            print(f"Warning: failed to open watch channel: {e}")
 
     # Response Logic
     # Use custom redirect if provided, else fallback
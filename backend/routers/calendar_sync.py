@@ -1,65 +1,150 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, BackgroundTasks
+from fastapi.responses import StreamingResponse
 import os
+import json
+import hmac
+import uuid
+import base64
 from services.supabase_client import supabase
-import requests
-from datetime import datetime, timedelta
-import re
+from services import http_client, token_store, google_sync, identity_cache, watch_channels, recurrence, conditional
+from services.sync_scheduler import scheduler
+from services.read_cache import read_cache
+from services.postgrest import is_missing_function
+from datetime import datetime, timedelta, timezone
 
 
 
-# Config
-GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID") or os.getenv("EXPO_PUBLIC_GOOGLE_WEB_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
-
 router = APIRouter()
 
-def refresh_google_token(account):
-    """Uses refresh_token to get a new access_token and updates DB."""
-    refresh_token = account.get('refresh_token')
-    if not refresh_token:
-        print(f"[{account.get('email')}] No refresh token available.")
-        return None
-        
-    url = "https://oauth2.googleapis.com/token"
-    data = {
-        "client_id": GOOGLE_CLIENT_ID,
-        "client_secret": GOOGLE_CLIENT_SECRET,
-        "refresh_token": refresh_token,
-        "grant_type": "refresh_token"
-    }
-    
-    try:
-        print(f"Refreshing token for {account.get('email')}...")
-        resp = requests.post(url, data=data)
-        if resp.status_code == 200:
-            new_tokens = resp.json()
-            new_access = new_tokens.get('access_token')
-            print(f"[{account.get('email')}] Token refreshed successfully.")
-            
-            # Update DB with new token and naive UTC time
-            supabase.table('connected_accounts').update({
-                'access_token': new_access,
-                'updated_at': datetime.utcnow().isoformat()
-            }).eq('id', account['id']).execute()
-            
-            return new_access
-        else:
-            print(f"[{account.get('email')}] Refresh failed: {resp.text}")
-            return None
-    except Exception as e:
-        print(f"Error refreshing token: {e}")
-        return None
+_bootstrap_rpc_available = True # Flipped off if the sync_bootstrap migration is not applied
+_events_rpc_available = True # Flipped off if the user_events_page migration is not applied
 
+# GET /events paging
+EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "200"))
+EVENTS_MAX_PAGE_SIZE = 1000
+EVENTS_DEFAULT_DAYS = int(os.getenv("EVENTS_DEFAULT_DAYS", "90")) # Window end when no `until` is given
+EVENTS_LOOKBACK = timedelta(hours=12)
+EVENT_COLUMNS = "id, google_event_id, account_id, title, start_time, end_time, location, meeting_link" # What the mapper reads
 
 @router.get("/fetch-from-google")
-def fetch_google_events(x_user_id: str = Header(None), x_google_token: str = Header(None), x_google_refresh_token: str = Header(None)):
-    
+def fetch_google_events(x_user_id: str = Header(None), x_google_token: str = Header(None), x_google_refresh_token: str = Header(None), full_sync: bool = False, wait: bool = False, stream: bool = False):
+    """Syncs events from Google for every connected account.
+
+    Accounts with a stored sync_token only fetch what changed since the last
+    sync. Pass full_sync=true to ignore stored tokens and re-download everything.
+    When the background scheduler runs, the sync is queued and the stored events
+    are returned immediately with sync_in_progress=true (wait=true syncs inline).
+    Overlapping calls for the same user share one sync (coalesced=true).
+
+    stream=true answers with NDJSON instead: {"type": "events", ...} lines as
+    each Google page is stored (unsorted), one {"type": "account", ...} line per
+    account when it finishes, then a {"type": "done", ...} trailer with upsert
+    status and per-account errors. Events of an account whose "account" line
+    reports an error may be incomplete.
+    """
+
     if not x_user_id:
          raise HTTPException(status_code=400, detail="Missing X-User-Id header")
 
-    print(f"\n--- Starting Event Fetch for User: {x_user_id} ---")
-    all_events = []
-    
+    if stream:
+        # Always syncs inline: the point is to see each account as soon as Google answers
+        print(f"\n--- Starting Streamed Event Fetch for User: {x_user_id} ---")
+        try:
+            sources = _build_sources(x_user_id, x_google_token, x_google_refresh_token)
+        except Exception as e:
+            print(f"CRITICAL ERROR in fetch_google_events: {e}")
+            sources = []
+        return StreamingResponse(_stream_sync(x_user_id, sources, full_sync), media_type="application/x-ndjson")
+
+    result, shared = google_sync.user_sync_flight.do(
+        (x_user_id, full_sync, wait),
+        lambda: _sync_user(x_user_id, x_google_token, x_google_refresh_token, full_sync, wait)
+    )
+    if shared:
+        print(f"Joined in-flight/recent sync for user {x_user_id}.")
+        return {**result, "coalesced": True}
+    return result
+
+
+def _lookup_email(x_google_token):
+    """Resolves the Google account email behind a session token (userinfo)."""
+    try:
+        user_info_resp = http_client.get(
+            "https://www.googleapis.com/oauth2/v2/userinfo",
+            headers={'Authorization': f'Bearer {x_google_token}'}
+        )
+    except Exception as e:
+        print(f"Error resolving primary token: {e}")
+        return None
+    if user_info_resp.status_code != 200:
+        print(f"Failed to get user info for primary token: {user_info_resp.text}")
+        return None
+    return user_info_resp.json().get('email', '').strip().lower() or None
+
+
+def _bootstrap(x_user_id, x_google_token, x_google_refresh_token):
+    """Runs the sync prelude as one sync_bootstrap RPC (see migrations/06_sync_bootstrap_rpc.sql).
+
+    The function ensures the public.users row, inserts or updates the session
+    account (never reactivating a disconnected one) and returns the active accounts.
+    Returns (accounts, primary_source) or None to use the separate queries instead.
+    """
+    global _bootstrap_rpc_available
+    if not _bootstrap_rpc_available:
+        return None
+
+    p_email = None
+    write_token = None
+    if x_google_token:
+        identity = identity_cache.get(x_user_id, x_google_token)
+        if identity:
+            p_email = identity['email']
+            # Only send the token if the DB copy has to change; the RPC never writes to a disconnected account
+            _, token_changed = token_store.adopt_session_token(identity['account_id'], x_google_token)
+            write_token = x_google_token if token_changed else None
+        else:
+            p_email = _lookup_email(x_google_token)
+            write_token = x_google_token
+
+    try:
+        resp = supabase.rpc("sync_bootstrap", {
+            "p_user_id": x_user_id,
+            "p_email": p_email,
+            "p_access_token": write_token if p_email else None,
+            "p_refresh_token": x_google_refresh_token if p_email else None
+        }).execute()
+    except Exception as e:
+        if is_missing_function(e):
+            print("sync_bootstrap RPC not found (migration 06 missing). Using separate queries.")
+            _bootstrap_rpc_available = False
+        else:
+            print(f"sync_bootstrap RPC failed: {e}")
+        return None
+
+    boot = resp.data or {}
+    accounts = boot.get('accounts') or []
+    p_id = boot.get('primary_account_id')
+    primary = None
+    if p_email and p_id:
+        p_active = boot.get('primary_is_active') is not False
+        identity_cache.remember(x_user_id, x_google_token, p_email, p_id)
+        if not p_active:
+            print(f"Skipping INACTIVE primary account: {p_email}")
+        else:
+            p_token, _ = token_store.adopt_session_token(p_id, x_google_token)
+            primary = {
+                'token': p_token,
+                'refresh_token': x_google_refresh_token, # Might be None
+                'email': p_email,
+                'id': p_id,
+                'sync_token': next((acc.get('sync_token') for acc in accounts if acc.get('id') == p_id), None),
+                'is_primary': True
+            }
+    return accounts, primary
+
+
+def _load_accounts(x_user_id):
+    """Separate-query fallback for _bootstrap: active accounts plus the users self-heal."""
     # 1. Get all connected accounts from DB
     try:
         # Filter by is_active (Soft Delete)
@@ -94,313 +179,236 @@ def fetch_google_events(x_user_id: str = Header(None), x_google_token: str = Hea
         except Exception as heal_err:
              print(f"Self-Healing Failed: {heal_err}")
 
+    return accounts
+
 
-    # 2. Build list of sources and fetch
+def _account_inactive(account_id):
+    """True if the account is disconnected (is_active = false), or its state cannot be read."""
     try:
-        sources = []
-        
-        # Add DB accounts
-        for acc in accounts:
-            sources.append({
-                'token': acc.get('access_token'),
-                'refresh_token': acc.get('refresh_token'),
-                'email': acc.get('email'),
-                'id': acc.get('id'),
-                'is_primary': False
-            })
+        resp = supabase.table("connected_accounts").select("is_active").eq("id", account_id).execute()
+    except Exception as e:
+        print(f"Error checking inactive status: {e}")
+        return True # Do not write tokens or sync an account we could not check
+    return bool(resp.data) and resp.data[0].get("is_active") is False
+
+
+def _resolve_primary_source(x_user_id, x_google_token, x_google_refresh_token, accounts):
+    """Resolves the session token's Google account into a sync source (or None).
+
+    The identity behind a token is cached by token fingerprint, so repeat syncs with
+    the same session skip the userinfo call, the users upsert and the account lookup.
+    Whether the account is still active always comes from the DB: `accounts` (the
+    active ones), else a single-column check. A disconnect may have been handled
+    by another worker, whose cache invalidation this process never sees.
+    """
+    cached = identity_cache.get(x_user_id, x_google_token)
+    if cached and not any(acc.get('id') == cached['account_id'] and acc.get('is_active') is not False for acc in accounts):
+        if _account_inactive(cached['account_id']):
+            print(f"Skipping INACTIVE primary account: {cached['email']}")
+            return None
+        # Linked or deleted since the accounts were loaded: resolve from scratch
+        identity_cache.forget_account(cached['account_id'])
+        cached = None
+    if cached:
+        p_id = cached['account_id']
+        p_token, token_changed = token_store.adopt_session_token(p_id, x_google_token)
+        if token_changed:
+            try:
+                supabase.table("connected_accounts").update({
+                    "access_token": x_google_token,
+                    "token_expires_at": None, # Unknown for session tokens
+                    "updated_at": datetime.utcnow().isoformat()
+                }).eq("id", p_id).execute()
+            except Exception as e:
+                print(f"Warning: Failed to store session token: {e}")
+        return {
+            'token': p_token,
+            'refresh_token': x_google_refresh_token, # Might be None
+            'email': cached['email'],
+            'id': p_id,
+            'sync_token': next((acc.get('sync_token') for acc in accounts if acc.get('id') == p_id), None),
+            'is_primary': True
+        }
+
+    # 2a. Resolve Email for Primary Token
+    primary = None
+    try:
+        user_info_resp = http_client.get(
+            "https://www.googleapis.com/oauth2/v2/userinfo",
+            headers={'Authorization': f'Bearer {x_google_token}'}
+        )
+        if user_info_resp.status_code == 200:
+            u_info = user_info_resp.json()
+            p_email = u_info.get('email', '').strip().lower()
+
+            # CRITICAL FIX: Ensure user exists in public.users to satisfy FK for events
+            try:
+                print(f"Ensuring user {x_user_id} ({p_email}) exists in public.users...")
+                supabase.table("users").upsert({
+                    "id": x_user_id,
+                    "email": p_email,
+                    "created_at": datetime.utcnow().isoformat()
+                }).execute()
+            except Exception as users_err:
+                print(f"Warning: Failed to ensure public.users existence: {users_err}")
+
+            with open("debug_sync_live.txt", "a") as dbg:
+                dbg.write(f"\n[{datetime.utcnow()}] Primary Token Email: '{p_email}'\n")
 
-        # Add Primary Header Token (Fallback/Session)
-        if x_google_token:
-            # 2a. Resolve Email for Primary Token
+            # CHECK IF SOFT DELETED (Inactive)
+            is_inactive = False
             try:
-                user_info_resp = requests.get(
-                    "https://www.googleapis.com/oauth2/v2/userinfo",
-                    headers={'Authorization': f'Bearer {x_google_token}'}
-                )
-                if user_info_resp.status_code == 200:
-                    u_info = user_info_resp.json()
-                    p_email = u_info.get('email', '').strip().lower()
-                    
-                    # CRITICAL FIX: Ensure user exists in public.users to satisfy FK for events
-                    try:
-                        print(f"Ensuring user {x_user_id} ({p_email}) exists in public.users...")
-                        supabase.table("users").upsert({
-                            "id": x_user_id,
-                            "email": p_email,
-                            "created_at": datetime.utcnow().isoformat()
-                        }).execute()
-                    except Exception as users_err:
-                        print(f"Warning: Failed to ensure public.users existence: {users_err}")
+                # Case insensitive match just to be safe, though we stored as is.
+                # We use ilike or just exact match on the normalized email?
+                # Our DB stores what Google gave us. standardizing to lower is good practice.
+                check_resp = supabase.table("connected_accounts").select("id, is_active, email, sync_token")\
+                    .eq("user_id", x_user_id)\
+                    .eq("email", p_email)\
+                    .execute()
+
+                msg = f"DB Check for '{p_email}': {check_resp.data}"
+                print(msg)
+                with open("debug_sync_live.txt", "a") as dbg:
+                    dbg.write(f"  {msg}\n")
+
+                if check_resp.data:
+                    # Account exists. Check activity.
+                    # Default is_active is TRUE. So check explicit False.
+                    acc_record = check_resp.data[0]
+                    if acc_record.get("is_active") is False:
+                        is_inactive = True
+            except Exception as e:
+                print(f"Error checking inactive status: {e}")
+                with open("debug_sync_live.txt", "a") as dbg:
+                    dbg.write(f"  Error checking status: {e}\n")
 
-                    with open("debug_sync_live.txt", "a") as dbg:
-                        dbg.write(f"\n[{datetime.utcnow()}] Primary Token Email: '{p_email}'\n")
-
-                    # CHECK IF SOFT DELETED (Inactive)
-                    is_inactive = False
-                    try:
-                        # Case insensitive match just to be safe, though we stored as is.
-                        # We use ilike or just exact match on the normalized email?
-                        # Our DB stores what Google gave us. standardizing to lower is good practice.
-                        check_resp = supabase.table("connected_accounts").select("id, is_active, email")\
-                            .eq("user_id", x_user_id)\
-                            .eq("email", p_email)\
-                            .execute()
-                        
-                        msg = f"DB Check for '{p_email}': {check_resp.data}"
-                        print(msg)
-                        with open("debug_sync_live.txt", "a") as dbg:
-                            dbg.write(f"  {msg}\n")
-
-                        if check_resp.data:
-                            # Account exists. Check activity.
-                            # Default is_active is TRUE. So check explicit False.
-                            acc_record = check_resp.data[0]
-                            if acc_record.get("is_active") is False:
-                                is_inactive = True
-                    except Exception as e:
-                        print(f"Error checking inactive status: {e}")
-                        with open("debug_sync_live.txt", "a") as dbg:
-                            dbg.write(f"  Error checking status: {e}\n")
-                    
-                    if is_inactive:
-                        skip_msg = f"Skipping INACTIVE primary account: {p_email}"
-                        print(skip_msg)
-                        with open("debug_sync_live.txt", "a") as dbg:
-                            dbg.write(f"  {skip_msg}\n")
+            if is_inactive:
+                identity_cache.remember(x_user_id, x_google_token, p_email, check_resp.data[0]['id'])
+                skip_msg = f"Skipping INACTIVE primary account: {p_email}"
+                print(skip_msg)
+                with open("debug_sync_live.txt", "a") as dbg:
+                    dbg.write(f"  {skip_msg}\n")
+            else:
+                # 2b. Upsert into connected_accounts to get a valid ID for persistence
+                # Only upsert if NOT inactive.
+
+                # CAREFUL: If we upsert here, we might accidentally re-activate if we are not careful?
+                # We only want to upsert if it DOES NOT EXIST.
+                # If it exists and is_active=True, we update tokens.
+
+                db_action = ""
+                p_id = None
+                p_sync_token = None
+
+                if check_resp.data:
+                    # Exists and is active (checked above)
+                    p_id = check_resp.data[0]['id']
+                    p_sync_token = check_resp.data[0].get('sync_token')
+                    update_data = {
+                        "updated_at": datetime.utcnow().isoformat()
+                    }
+                    # Keep our own refreshed token if it is still valid; else adopt the session token
+                    p_token, token_changed = token_store.adopt_session_token(p_id, x_google_token)
+                    if token_changed:
+                        update_data["access_token"] = x_google_token
+                        update_data["token_expires_at"] = None # Unknown for session tokens
+                    if x_google_refresh_token:
+                        update_data["refresh_token"] = x_google_refresh_token
+
+                    supabase.table("connected_accounts").update(update_data).eq("id", p_id).execute()
+                    db_action = "Updated"
+                else:
+                    # Does not exist. Insert new.
+                    account_data = {
+                        "user_id": x_user_id,
+                        "email": p_email,
+                        "access_token": x_google_token,
+                        "is_active": True,
+                        "updated_at": datetime.utcnow().isoformat()
+                    }
+                    if x_google_refresh_token:
+                        account_data["refresh_token"] = x_google_refresh_token
+
+                    upsert_resp = supabase.table("connected_accounts").insert(account_data).execute()
+                    if upsert_resp.data:
+                        p_id = upsert_resp.data[0]['id']
+                        p_token = x_google_token
+                        token_store.remember(p_id, p_token)
+                        db_action = "Inserted"
                     else:
-                        # 2b. Upsert into connected_accounts to get a valid ID for persistence
-                        # Only upsert if NOT inactive.
-                        
-                        # CAREFUL: If we upsert here, we might accidentally re-activate if we are not careful?
-                        # We only want to upsert if it DOES NOT EXIST.
-                        # If it exists and is_active=True, we update tokens.
-                        
-                        db_action = ""
-                        p_id = None
-                        
-                        if check_resp.data:
-                            # Exists and is active (checked above)
-                            p_id = check_resp.data[0]['id']
-                            update_data = {
-                                "access_token": x_google_token,
-                                "updated_at": datetime.utcnow().isoformat()
-                            }
-                            if x_google_refresh_token:
-                                update_data["refresh_token"] = x_google_refresh_token
-                            
-                            supabase.table("connected_accounts").update(update_data).eq("id", p_id).execute()
-                            db_action = "Updated"
-                        else:
-                            # Does not exist. Insert new.
-                            account_data = {
-                                "user_id": x_user_id,
-                                "email": p_email,
-                                "access_token": x_google_token,
-                                "is_active": True,
-                                "updated_at": datetime.utcnow().isoformat()
-                            }
-                            if x_google_refresh_token:
-                                account_data["refresh_token"] = x_google_refresh_token
-                                
-                            upsert_resp = supabase.table("connected_accounts").insert(account_data).execute()
-                            if upsert_resp.data:
-                                p_id = upsert_resp.data[0]['id']
-                                db_action = "Inserted"
-                            else:
-                                db_action = "Insert Failed"
-
-                        if p_id:
-                            sources.append({
-                                'token': x_google_token,
-                                'refresh_token': x_google_refresh_token, # Might be None
-                                'email': p_email,
-                                'id': p_id,
-                                'is_primary': True
-                            })
-                            with open("debug_sync_live.txt", "a") as dbg:
-                                dbg.write(f"  Processed Primary: {db_action} ID [{p_id}]\n")
-                        else:
-                             print("Failed to persist primary account.")
+                        db_action = "Insert Failed"
+
+                if p_id:
+                    primary = {
+                        'token': p_token,
+                        'refresh_token': x_google_refresh_token, # Might be None
+                        'email': p_email,
+                        'id': p_id,
+                        'sync_token': p_sync_token,
+                        'is_primary': True
+                    }
+                    identity_cache.remember(x_user_id, x_google_token, p_email, p_id)
+                    with open("debug_sync_live.txt", "a") as dbg:
+                        dbg.write(f"  Processed Primary: {db_action} ID [{p_id}]\n")
                 else:
-                    print(f"Failed to get user info for primary token: {user_info_resp.text}")
-            except Exception as e:
-                print(f"Error resolving primary token: {e}")
-                with open("debug_sync_live.txt", "a") as dbg:
-                    dbg.write(f"  Error resolving primary: {e}\n")
+                     print("Failed to persist primary account.")
+        else:
+            print(f"Failed to get user info for primary token: {user_info_resp.text}")
+    except Exception as e:
+        print(f"Error resolving primary token: {e}")
+        with open("debug_sync_live.txt", "a") as dbg:
+            dbg.write(f"  Error resolving primary: {e}\n")
 
-        if not sources:
-             print("No accounts connected and no session token provided.")
-             return {"events": []}
-        
-        # Time Min start of today UTC
-        # Use simple naive UTC + 'Z' to satisfy Google API
-        time_min = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + 'Z'
-        print(f"Fetching events from: {time_min}")
-        
-        fetched_emails = set()
-        events_to_upsert = []
+    return primary
 
-        for source in sources:
-            source_email = source.get('email', 'Unknown')
-            token = source['token']
-            
-            # Dedup
-            if source_email in fetched_emails and source_email != 'Primary (Session)':
-                continue
 
-            print(f"Fetching for: {source_email}...")
+def _build_sources(x_user_id, x_google_token, x_google_refresh_token):
+    """Returns the sync sources for a user: active DB accounts plus the session token."""
+    # Get active accounts, ensure public.users, resolve the session account.
+    # One RPC round trip when the sync_bootstrap migration is applied.
+    boot = _bootstrap(x_user_id, x_google_token, x_google_refresh_token)
+    if boot is None:
+        accounts = _load_accounts(x_user_id)
+    else:
+        accounts, primary = boot
+        print(f"Found {len(accounts)} connected accounts in DB (bootstrap RPC).")
 
-            # Function to fetch all pages
-            def fetch_with_retry(token, refresh_token):
-                all_items = []
-                page_token = None
-                
-                while True:
-                    url = f"https://www.googleapis.com/calendar/v3/calendars/primary/events?timeMin={time_min}&singleEvents=true&orderBy=startTime&maxResults=250"
-                    if page_token:
-                        url += f"&pageToken={page_token}"
-                        
-                    headers = {'Authorization': f'Bearer {token}'}
-                    print(f"[{source_email}] Requesting page...")
-                    response = requests.get(url, headers=headers)
-                    
-                    if response.status_code == 401:
-                        if refresh_token:
-                            print(f"[{source_email}] Token 401. Attempting refresh...")
-                            new_token = refresh_google_token(source)
-                            if new_token:
-                                token = new_token # Update local token var for next loop
-                                continue # Retry the SAME request (loop will rebuild url without nextToken if it was first page, or with it? Wait. Logic needs to be robust)
-                                # Actually, if we refresh, we should probably restart the fetch or just retry the current page?
-                                # Ideally retry current request.
-                                # But let's keep it simple: if refresh works, update token and retry the iteration.
-                            else:
-                                print(f"[{source_email}] Refresh failed. Abort.")
-                                return 401, []
-                        else:
-                             return 401, []
-                    
-                    if response.status_code != 200:
-                        return response.status_code, []
-                        
-                    data = response.json()
-                    items = data.get('items', [])
-                    all_items.extend(items)
-                    
-                    page_token = data.get('nextPageToken')
-                    if not page_token:
-                        break
-                        
-                return 200, all_items
-
-            status_code, items = fetch_with_retry(token, source['refresh_token'])
-            
-            # Process Response
-            if status_code == 200:
-                if source_email != 'Unknown':
-                     fetched_emails.add(source_email)
+    sources = []
 
-                print(f"[{source_email}] Success. Found {len(items)} events total.")
-                
-                for item in items:
-                    # Skip cancelled
-                    if item.get('status') == 'cancelled':
-                        continue
-                        
-                    start_raw = item.get('start', {}).get('dateTime') or item.get('start', {}).get('date')
-                    end_raw = item.get('end', {}).get('dateTime') or item.get('end', {}).get('date')
-                    
-                    # Formatting time string for UI
-                    try:
-                        # Simple parse
-                        if 'T' in start_raw:
-                            # Is ISO format with likely offset or Z
-                            # We just want a simple HH:MM AM/PM representation
-                            # This is rough but works for display
-                            # Better: use dateutil, but trying to keep deps minimal if not installed
-                             val = start_raw.split('T')[1][:5]
-                             # Convert 24h to 12h manually or use datetime
-                             # Let's try datetime parse
-                             dt = datetime.fromisoformat(start_raw.replace('Z', '+00:00'))
-                             time_str = dt.strftime("%I:%M %p")
-                        else:
-                             # Full day
-                             time_str = "All Day"
-                    except:
-                        time_str = start_raw
-
-                    
-                    # Extract Meeting Link
-                    meeting_link = item.get('hangoutLink')
-                    if not meeting_link:
-                        # Search in description and location
-                        text_to_search = (item.get('description') or '') + " " + (item.get('location') or '')
-                        # Regex for common meeting tools (Google Meet, Zoom, Teams)
-                        try:
-                            # Expanded regex to catch more variations
-                            match = re.search(r'(https?://)?(meet\.google\.com/[a-z]{3}-[a-z]{4}-[a-z]{3}|zoom\.us/j/\d+|teams\.microsoft\.com/l/meetup-join/[^\s"<]+)', text_to_search, re.IGNORECASE)
-                            if match:
-                                meeting_link = match.group(0)
-                                # Ensure protocol
-                                if not meeting_link.startswith('http'):
-                                    meeting_link = 'https://' + meeting_link
-                                print(f"DEBUG: Found Manual Meeting Link for '{item.get('summary')}': {meeting_link}")
-                        except Exception as e:
-                            print(f"Regex Error: {e}")
-
-                    event_obj = {
-                        'id': item.get('id'),
-                        'title': item.get('summary', '(No Title)'),
-                        'start': start_raw,
-                        'end': end_raw,
-                        'time': time_str,
-                        'link': item.get('htmlLink'),
-                        'meeting_link': meeting_link,
-                        'source': source_email,
-                        'calendar': 'Google',
-                        'color': '#4F46E5' 
-                    }
-                    all_events.append(event_obj)
-                    
-                    # DB Upsert Preparation
-                    # Persist ALL accounts now since we have valid IDs
-                    if source['id']:
-                        if not start_raw or not end_raw:
-                            print(f"Skipping event {item.get('id')} due to missing dates.")
-                            continue
-
-                        db_record = {
-                             "user_id": x_user_id,
-                             "account_id": source['id'],
-                             "google_event_id": item['id'],
-                             "title": item.get('summary', '(No Title)'),
-                             "description": item.get('description', ''),
-                             "start_time": start_raw,
-                             "end_time": end_raw,
-                             "is_all_day": 'date' in item.get('start', {}),
-                             "location": item.get('location'),
-                             "html_link": item.get('htmlLink'),
-                             "meeting_link": meeting_link,
-                             "updated_at": datetime.utcnow().isoformat()
-                        }
-                        events_to_upsert.append(db_record)
+    # Add DB accounts
+    for acc in accounts:
+        sources.append(google_sync.source_from_account(acc))
 
-            else:
-                 print(f"[{source_email}] API Error: {response.status_code} {response.text}")
+    # Add Primary Header Token (Fallback/Session)
+    if boot is None and x_google_token:
+        primary = _resolve_primary_source(x_user_id, x_google_token, x_google_refresh_token, accounts)
+    if x_google_token and primary:
+        sources.append(primary)
 
-        # Upsert
-        upsert_error = None
-        if events_to_upsert:
-            try:
-                print(f"DEBUG: Prepare to persist {len(events_to_upsert)} events.")
-                # print(f"Sample Event: {events_to_upsert[0]['google_event_id']}")
-                resp = supabase.table("events").upsert(events_to_upsert, on_conflict="account_id, google_event_id").execute()
-                print(f"Events persisted. Response: {len(resp.data) if resp.data else 'No Data'}")
-            except Exception as e:
-                print(f"Upsert failed: {e}")
-                upsert_error = str(e)
-        else:
-             print("DEBUG: events_to_upsert is EMPTY.")
+    return sources
+
+
+def _sync_user(x_user_id, x_google_token, x_google_refresh_token, full_sync, wait):
+    print(f"\n--- Starting Event Fetch for User: {x_user_id} ---")
+    all_events = []
+
+    try:
+        sources = _build_sources(x_user_id, x_google_token, x_google_refresh_token)
+        if not sources:
+             print("No accounts connected and no session token provided.")
+             return {"events": []}
+        
+        # Take Google off the request path: queue the accounts and answer from the DB
+        if scheduler.is_running and not (wait or full_sync):
+            account_ids = [source['id'] for source in sources if source.get('id')]
+            scheduler.request_sync(account_ids)
+            db_result, _ = cached_db_events(x_user_id)
+            return {**db_result, "sync_in_progress": scheduler.is_syncing(account_ids)}
+
+        result = google_sync.sync_sources(x_user_id, sources, full_sync)
+        all_events = result["events"]
+        # Open or renew push channels (the scheduler does this when it runs)
+        watch_channels.ensure_channels([source['id'] for source in sources if source.get('id')])
 
     except Exception as e:
         print(f"CRITICAL ERROR in fetch_google_events: {e}")
@@ -411,15 +419,210 @@ def fetch_google_events(x_user_id: str = Header(None), x_google_token: str = Hea
 
 
     print(f"Returning {len(all_events)} events total.")
-    return {"events": all_events, "upsert_error": upsert_error}
+    return result
+
+
+def _ndjson(obj):
+    return json.dumps(obj, default=str) + "\n"
+
+
+def _stream_sync(x_user_id, sources, full_sync):
+    """Yields NDJSON lines: "events" per Google page, "account" per finished account, then a "done" trailer."""
+    total = 0
+    upsert_error = None
+    errors = {} # email -> error message
+    sync_modes = {}
+    persist_stats = {}
+    try:
+        for message in google_sync.iter_sync_sources(x_user_id, sources, full_sync):
+            if message["type"] == "account":
+                if message["status_code"] == 200:
+                    sync_modes[message["email"]] = message["mode"]
+                    total += message["event_count"]
+                if message["persist_stats"] is not None:
+                    persist_stats[message["account_id"]] = message["persist_stats"]
+                if message["error"]:
+                    errors[message["email"]] = message["error"]
+                    if message["status_code"] == 200:
+                        upsert_error = upsert_error or message["error"]
+            yield _ndjson(message)
+    except Exception as e:
+        print(f"CRITICAL ERROR in streamed fetch_google_events: {e}")
+        import traceback
+        traceback.print_exc()
+        errors["_sync"] = str(e)
+    watch_channels.ensure_channels([source['id'] for source in sources if source.get('id')])
+
+    print(f"Streamed {total} events total.")
+    yield _ndjson({
+        "type": "done",
+        "total_events": total,
+        "upsert_error": upsert_error,
+        "errors": errors,
+        "sync_modes": sync_modes,
+        "persist_stats": persist_stats
+    })
+
+
+@router.post("/webhook")
+def google_webhook(background_tasks: BackgroundTasks, x_goog_channel_id: str = Header(None), x_goog_channel_token: str = Header(None), x_goog_resource_id: str = Header(None), x_goog_resource_state: str = Header(None)):
+    """Receives Google Calendar push notifications (see services/watch_channels.py).
+
+    A change notification queues an incremental sync for the one account that
+    owns the channel; the sync runs after the response is sent.
+    """
+    if not x_goog_channel_id:
+        raise HTTPException(status_code=400, detail="Missing X-Goog-Channel-ID header")
+
+    account = watch_channels.find_account(x_goog_channel_id)
+    if not account:
+        # Replaced or stopped channel (or the "sync" handshake racing create_channel); 2xx so Google does not retry
+        print(f"Webhook: unknown channel {x_goog_channel_id} ({x_goog_resource_state}), ignoring.")
+        return {"status": "ignored"}
+
+    if not hmac.compare_digest(account.get('watch_token') or '', x_goog_channel_token or '') \
+            or account.get('watch_resource_id') != x_goog_resource_id:
+        print(f"Webhook: token/resource mismatch for channel {x_goog_channel_id}.")
+        raise HTTPException(status_code=403, detail="Invalid channel token")
+
+    if x_goog_resource_state == "sync" or not account.get('is_active'):
+        return {"status": "ok"} # "sync" is the handshake sent when a channel opens
+
+    print(f"Webhook: {x_goog_resource_state} for account {account['id']}, queueing sync.")
+    if scheduler.is_running:
+        scheduler.request_sync([account['id']])
+    else:
+        background_tasks.add_task(watch_channels.sync_changed_account, account['id'])
+    return {"status": "queued"}
 
 
 @router.get("/events")
-def get_db_events(user_id: str):
+def get_db_events(user_id: str, until: str = None, cursor: str = None, limit: int = EVENTS_PAGE_SIZE, if_none_match: str = Header(None)):
+    """Stored events of the user's active accounts, one page at a time. Supports If-None-Match (304).
+
+    Events start between 12h ago and `until` (ISO; default EVENTS_DEFAULT_DAYS
+    ahead) in (start, id) order. Pass the returned next_cursor to get the next
+    page; it is null on the last one.
+    """
     try:
-        # Fetch appropriate range (e.g., today onwards)
-        now = datetime.utcnow()
-        lookback = now - timedelta(hours=12) 
+        until_dt = recurrence.sort_key(until) if until else None
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid until or cursor")
+    limit = max(1, min(limit, EVENTS_MAX_PAGE_SIZE))
+
+    endpoint = f"events:{until}:{cursor}:{limit}"
+    version = conditional.data_version(user_id)
+    unchanged = conditional.not_modified(endpoint, user_id, if_none_match, version)
+    if unchanged:
+        return unchanged
+
+    result, valid_until = cached_db_events(user_id, until_dt, after, limit)
+    if result.get("error"):
+        version = None # Never serve a failed read as "not modified"
+    return conditional.respond(endpoint, user_id, result, if_none_match, version, valid_until)
+
+
+def cached_db_events(user_id, until=None, after=None, limit=EVENTS_PAGE_SIZE):
+    """load_db_events through the per-user read cache. Returns (result, valid_until).
+
+    valid_until (epoch seconds or None) is when the page changes without any
+    write. The result may be shared with other requests: do not modify it.
+    """
+    key = ("events", until.isoformat() if until else None, after, limit)
+    cached = read_cache.get(user_id, key)
+    if cached is not None:
+        return cached
+
+    generation = read_cache.generation(user_id)
+    result = load_db_events(user_id, until, after, limit)
+    # The oldest event drops out of the 12h lookback even without any write
+    starts = [recurrence.sort_key(ev['start']) for ev in result["events"] if ev.get('start')]
+    valid_until = (min(starts) + EVENTS_LOOKBACK).timestamp() if starts else None
+    if until is None:
+        # ...and the default window moves on at midnight (UTC)
+        next_midnight = _default_until() - timedelta(days=EVENTS_DEFAULT_DAYS)
+        valid_until = min(valid_until or float("inf"), next_midnight.timestamp())
+    if not result.get("error"):
+        read_cache.set(user_id, key, (result, valid_until), generation, expires_at=valid_until)
+    return result, valid_until
+
+
+def _default_until():
+    # Whole days, so the window (and the ETag) only changes once a day
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today + timedelta(days=EVENTS_DEFAULT_DAYS + 1)
+
+
+def _encode_cursor(row):
+    raw = f"{row['start_time']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """(start, row id) of a next_cursor value. Raises ValueError if it is malformed."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    start, _, row_id = raw.partition("|")
+    uuid.UUID(row_id[:36]) # Expanded instances are "<master uuid>_<stamp>"
+    return recurrence.sort_key(start), row_id
+
+
+def _row_key(row):
+    return (recurrence.sort_key(row['start_time']), row['id'])
+
+
+def _events_page(user_id, active_ids, window_start, window_end, after, limit):
+    """Up to `limit` stored (non-master) rows after the cursor, one per google_event_id.
+
+    Uses the user_events_page RPC (migrations/10), which de-duplicates in the
+    database. Without it, the same keyset query runs against the table and
+    duplicates are only dropped within the page (see load_db_events).
+    """
+    global _events_rpc_available
+    # An instance cursor ("<uuid>_<stamp>") sorts right after its master's uuid
+    after_start, after_id = (after[0].isoformat(), after[1][:36]) if after else (None, None)
+
+    if _events_rpc_available:
+        try:
+            return supabase.rpc("user_events_page", {
+                "p_user_id": user_id,
+                "p_account_ids": active_ids,
+                "p_from": window_start.isoformat(),
+                "p_until": window_end.isoformat(),
+                "p_after_start": after_start,
+                "p_after_id": after_id,
+                "p_limit": limit
+            }).execute().data or []
+        except Exception as e:
+            if is_missing_function(e):
+                print("user_events_page RPC not found (migration 10 missing). Using a table query.")
+                _events_rpc_available = False
+            else:
+                raise
+
+    query = supabase.table("events")\
+        .select(EVENT_COLUMNS)\
+        .eq("user_id", user_id)\
+        .in_("account_id", active_ids)\
+        .gte("start_time", window_start.isoformat())\
+        .lte("start_time", window_end.isoformat())
+    if recurrence.SYNC_RECURRENCE_MASTERS:
+        # Series are expanded separately; cancelled instances only mark what to skip
+        query = query.is_("recurrence", "null").eq("is_cancelled", False)
+    if after:
+        query = query.or_(f'start_time.gt."{after_start}",and(start_time.eq."{after_start}",id.gt.{after_id})')
+    return query.order("start_time").order("id").limit(limit).execute().data or []
+
+
+def load_db_events(user_id, until=None, after=None, limit=EVENTS_PAGE_SIZE):
+    """One page of mapped events: {"events": [...], "next_cursor": str or None}.
+
+    until is an aware datetime (default: EVENTS_DEFAULT_DAYS ahead), after a
+    decoded cursor (start, row id) or None for the first page.
+    """
+    try:
+        window_start = datetime.now(timezone.utc) - EVENTS_LOOKBACK
+        window_end = until or _default_until()
         
         # 1. Get Active Accounts and Build Map
         account_map = {}
@@ -448,21 +651,27 @@ def get_db_events(user_id: str):
              except:
                  pass
 
-        if not active_ids:
-            return {"events": []}
+        if not active_ids or window_end < window_start:
+            return {"events": [], "next_cursor": None}
+
+        # One row more than the page tells whether another page follows
+        rows = _events_page(user_id, active_ids, window_start, window_end, after, limit + 1)
+
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            instances = recurrence.load_instances(user_id, window_start, window_end, account_ids=active_ids,
+                                                  columns=EVENT_COLUMNS + ", recurrence")
+            if after:
+                instances = [row for row in instances if _row_key(row) > after]
+            rows = rows + instances
+            rows.sort(key=_row_key)
 
-        response = supabase.table("events")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .gte("start_time", lookback.isoformat())\
-            .in_("account_id", active_ids)\
-            .order("start_time")\
-            .execute()
+        next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        rows = rows[:limit]
             
         mapped_events = []
-        seen_ids = set()
+        seen_ids = set() # Only matters without the RPC, which de-duplicates across pages
         
-        for ev in response.data:
+        for ev in rows:
             g_id = ev.get('google_event_id')
             if g_id in seen_ids:
                 continue
@@ -484,7 +693,7 @@ def get_db_events(user_id: str):
                 'duration': 'Event' 
             })
             
-        return {"events": mapped_events}
+        return {"events": mapped_events, "next_cursor": next_cursor}
     except Exception as e:
         print(f"Error fetching DB events: {e}")
-        return {"events": []}
+        return {"events": [], "next_cursor": None, "error": str(e)}
@@ -1,12 +1,29 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from services.supabase_client import supabase
+from services import recurrence, conditional, reminder_store, reminder_changes, reminder_expansion, settings_store
+from services.read_cache import read_cache
+from services.postgrest import chunks, is_missing_function
+from services.reminder_dispatcher import reminder_dispatcher, STREAM_HEARTBEAT_SECONDS, STREAM_QUEUE_SIZE
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
 from datetime import datetime, timedelta, timezone
 
 router = APIRouter()
 
+UPCOMING_FETCH_WORKERS = int(os.getenv("UPCOMING_FETCH_WORKERS", "16")) # Threads for the concurrent /reminders/upcoming queries
+ACCOUNT_EMBED = "connected_accounts(email)" # Account email of an event, embedded instead of a separate query
+
+EVENT_BATCH_MAX_ITEMS = 500 # PUT /reminders/events
+
+_fetch_pool = ThreadPoolExecutor(max_workers=UPCOMING_FETCH_WORKERS, thread_name_prefix="upcoming-fetch")
+_bulk_offsets_rpc_available = True # Flipped off if migration 12 is not applied
+
 # Initialize Supabase Client
 
 
@@ -22,29 +39,18 @@ class AlarmSettings(BaseModel):
 class EventReminderSettings(BaseModel):
     reminder_offsets: List[int]
 
+class EventReminderUpdate(BaseModel):
+    event_id: str # Google event ID, events.id, or an expanded instance ID (applies to its series)
+    reminder_offsets: List[int]
+
+class EventReminderBatch(BaseModel):
+    items: List[EventReminderUpdate]
+
 @router.get("/settings")
-def get_settings(user_id: str):
+def get_settings(user_id: str, if_none_match: str = Header(None)):
+    """The user's alarm settings (defaults if none are saved). ETag is the settings version."""
     try:
-        response = supabase.table("alarm_settings").select("*").eq("user_id", user_id).execute()
-        if not response.data:
-            # Create default settings if not exists
-            default_settings = {
-                "user_id": user_id,
-                "global_reminder_offset_minutes": 30,
-                "reminder_offsets": [30],
-                "default_alarm_sound": "default",
-                "morning_mode_enabled": False,
-                "morning_mode_sound": "default"
-            }
-            supabase.table("alarm_settings").insert(default_settings).execute()
-            return default_settings
-        
-        # Backfill if reminder_offsets is missing from old data
-        data = response.data[0]
-        if not data.get("reminder_offsets"):
-             data["reminder_offsets"] = [data.get("global_reminder_offset_minutes", 30)]
-             
-        return data
+        settings = settings_store.get(user_id)
     except Exception as e:
         print(f"DB Error in get_settings: {e}")
         # Return a safe default to prevent frontend crash
@@ -54,25 +60,30 @@ def get_settings(user_id: str):
             "reminder_offsets": [30],
             "default_alarm_sound": "default"
         }
+    return conditional.respond_with_etag(f'"settings-{settings["version"]}"', settings, if_none_match)
 
 @router.put("/settings")
 def update_settings(settings: AlarmSettings):
     try:
         # Upsert settings
         data = settings.dict()
-        data["updated_at"] = datetime.now(timezone.utc).isoformat()
         # Normalize: ensure global_reminder_offset_minutes is just the first one or 30
         if data["reminder_offsets"]:
             data["global_reminder_offset_minutes"] = data["reminder_offsets"][0]
         
-        response = supabase.table("alarm_settings").upsert(data).execute()
-        if response.data:
-            return response.data[0]
-        return {}
+        stored = settings_store.put(settings.user_id, data)
+        try:
+            reminder_store.materialize_user(settings.user_id) # Default offsets changed
+        except Exception as e:
+            print(f"DB Error materializing reminders: {e}")
+            reminder_store.mark_stale(settings.user_id)
+        read_cache.invalidate(settings.user_id, kinds=("upcoming",))
+        return stored
     except Exception as e:
         import traceback
         traceback.print_exc()
-
+        # The write may or may not have happened
+        settings_store.forget(settings.user_id)
         
         print(f"DB Error in update_settings: {e}")
         raise HTTPException(status_code=500, detail=f"Database Sync Error: {e}")
@@ -86,6 +97,14 @@ def is_valid_uuid(val):
     except ValueError:
         return False
 
+def _refresh_reminders(user_id, rows):
+    # The offsets are saved either way; after a failed refresh the next read re-materializes the user
+    try:
+        reminder_store.refresh_events(user_id, rows)
+    except Exception as e:
+        print(f"DB Error refreshing reminders: {e}")
+        reminder_store.mark_stale(user_id)
+
 @router.put("/events/{event_identifier}")
 def update_event_reminders(event_identifier: str, settings: EventReminderSettings, user_id: str):
     try:
@@ -104,6 +123,8 @@ def update_event_reminders(event_identifier: str, settings: EventReminderSetting
         
         if response.data:
             print(f"Updated event reminders via Google ID: {event_identifier} for user {user_id}")
+            _refresh_reminders(user_id, response.data)
+            read_cache.invalidate(user_id, kinds=("upcoming",)) # /calendar/events does not show offsets
             return response.data[0]
             
         # 2. If not found, try updating by Internal UUID (Fallback)
@@ -114,6 +135,19 @@ def update_event_reminders(event_identifier: str, settings: EventReminderSetting
         
             if response.data:
                 print(f"Updated event reminders via UUID: {event_identifier}")
+                _refresh_reminders(user_id, response.data)
+                read_cache.invalidate(user_id, kinds=("upcoming",))
+                return response.data[0]
+
+        # 3. Expanded instance of a stored series: the setting applies to the whole series
+        base_id = recurrence.series_id(event_identifier) if recurrence.SYNC_RECURRENCE_MASTERS else None
+        if base_id:
+            column = "id" if is_valid_uuid(base_id) else "google_event_id"
+            response = supabase.table("events").update(data).eq(column, base_id).eq("user_id", user_id).execute()
+            if response.data:
+                print(f"Updated series reminders via instance: {event_identifier}")
+                _refresh_reminders(user_id, response.data)
+                read_cache.invalidate(user_id, kinds=("upcoming",))
                 return response.data[0]
 
         print(f"Event not found for reminder update: {event_identifier}")
@@ -128,11 +162,137 @@ def update_event_reminders(event_identifier: str, settings: EventReminderSetting
 
 
 
+@router.put("/events")
+def update_event_reminders_batch(batch: EventReminderBatch, user_id: str):
+    """Per-event reminder overrides for many events at once.
+
+    Each event_id is resolved like PUT /events/{event_identifier}: Google
+    event ID first, then events.id, then the series of an expanded instance.
+    Returns {"results": [{"event_id", "status": "updated" | "not_found", "updated": rows}], "updated": rows}.
+    """
+    if len(batch.items) > EVENT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {EVENT_BATCH_MAX_ITEMS} events per request")
+    try:
+        rows = _resolve_events(user_id, [item.event_id for item in batch.items])
+
+        # events.id -> offsets; a later item wins if two resolve to the same row
+        targets = {}
+        results = []
+        for item in batch.items:
+            ids = _matching_ids(item.event_id, rows)
+            for row_id in ids:
+                targets[row_id] = item.reminder_offsets
+            results.append({"event_id": item.event_id, "status": "updated" if ids else "not_found", "updated": len(ids)})
+
+        updated = _set_reminder_offsets(user_id, targets) if targets else []
+        if updated:
+            print(f"Updated event reminders of {len(updated)} events for user {user_id}")
+            _refresh_reminders(user_id, updated)
+            read_cache.invalidate(user_id, kinds=("upcoming",)) # /calendar/events does not show offsets
+        return {"results": results, "updated": len(updated)}
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        print(f"DB Error in update_event_reminders_batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Database Update Error: {e}")
+
+
+def _lookup_keys(identifier):
+    """(google_event_id or events.id) candidates of an identifier, most specific first.
+
+    events.id candidates are canonical (lowercase) UUID strings, as PostgREST returns them.
+    """
+    keys = [("google_event_id", identifier)]
+    if is_valid_uuid(identifier):
+        keys.append(("id", str(UUID(identifier))))
+    base_id = recurrence.series_id(identifier) if recurrence.SYNC_RECURRENCE_MASTERS else None
+    if base_id:
+        keys.append(("id", str(UUID(base_id))) if is_valid_uuid(base_id) else ("google_event_id", base_id))
+    return keys
+
+
+def _resolve_events(user_id, identifiers):
+    """The user's events rows (id, google_event_id) matching any candidate of the identifiers."""
+    google_ids, row_ids = set(), set()
+    for identifier in identifiers:
+        for column, value in _lookup_keys(identifier):
+            (row_ids if column == "id" else google_ids).add(value)
+
+    def quoted(values):
+        return ",".join('"' + value.replace('"', '\\"') + '"' for value in values)
+
+    rows = []
+    for google_chunk, id_chunk in zip_longest(chunks(sorted(google_ids)), chunks(sorted(row_ids)), fillvalue=[]):
+        filters = []
+        if google_chunk:
+            filters.append(f"google_event_id.in.({quoted(google_chunk)})")
+        if id_chunk:
+            filters.append(f"id.in.({','.join(id_chunk)})")
+        rows.extend(supabase.table("events").select("id, google_event_id")
+                    .eq("user_id", user_id)
+                    .or_(",".join(filters))
+                    .execute().data or [])
+    return rows
+
+
+def _matching_ids(identifier, rows):
+    """events.id values an identifier updates: those of its first candidate that matches any row."""
+    for column, value in _lookup_keys(identifier):
+        if column == "id":
+            ids = [row["id"] for row in rows if str(UUID(str(row["id"]))) == value]
+        else:
+            ids = [row["id"] for row in rows if str(row[column]) == value]
+        if ids:
+            return ids
+    return []
+
+
+def _set_reminder_offsets(user_id, targets):
+    """Writes {events.id: offsets} and returns the updated rows.
+
+    One statement via the set_event_reminder_offsets RPC (migrations/12);
+    without it, one update per distinct offsets list.
+    """
+    global _bulk_offsets_rpc_available
+    if _bulk_offsets_rpc_available:
+        try:
+            return supabase.rpc("set_event_reminder_offsets", {
+                "p_user_id": user_id,
+                "p_updates": [{"id": row_id, "reminder_offsets": offsets} for row_id, offsets in targets.items()]
+            }).execute().data or []
+        except Exception as e:
+            if is_missing_function(e):
+                print("set_event_reminder_offsets RPC not found (migration 12 missing). Using grouped updates.")
+                _bulk_offsets_rpc_available = False
+            else:
+                raise
+
+    groups = {}
+    for row_id, offsets in targets.items():
+        groups.setdefault(tuple(offsets), []).append(row_id)
+    updated = []
+    for offsets, ids in groups.items():
+        data = {
+            "reminder_offsets": list(offsets),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        for chunk in chunks(ids):
+            updated.extend(supabase.table("events").update(data)
+                           .in_("id", chunk)
+                           .eq("user_id", user_id)
+                           .execute().data or [])
+    return updated
+
+
 @router.get("/events/{event_id}")
 def get_event_settings(event_id: str):
     try:
         # Use google_event_id instead of id
         response = supabase.table("events").select("reminder_offsets").eq("google_event_id", event_id).execute()
+        base_id = recurrence.series_id(event_id) if recurrence.SYNC_RECURRENCE_MASTERS else None
+        if not response.data and base_id:
+            # Expanded instance of a stored series
+            response = supabase.table("events").select("reminder_offsets").eq("google_event_id", base_id).execute()
         if response.data:
             # If multiple accounts have same event, just return the first one's settings
             return response.data[0] 
@@ -146,128 +306,372 @@ def get_event_settings(event_id: str):
         print(f"DB Error in get_event_settings: {e}")
         raise HTTPException(status_code=500, detail=f"Database Fetch Error: {e}")
 
+@router.post("/dismiss/{reminder_id}")
+def dismiss_reminder(reminder_id: str, user_id: str):
+    """Marks a materialized reminder (reminder_id from /upcoming) as dismissed, so it is not sent again."""
+    if not is_valid_uuid(reminder_id):
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    try:
+        dismissed = reminder_store.dismiss(user_id, reminder_id)
+    except Exception as e:
+        print(f"DB Error in dismiss_reminder: {e}")
+        raise HTTPException(status_code=500, detail=f"Database Update Error: {e}")
+    if not dismissed:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    return {"dismissed": True}
+
+@router.get("/stream")
+async def stream_reminders(request: Request, user_id: str, cursor: str = None, last_event_id: str = Header(None)):
+    """Server-Sent Events: one "reminder" event per reminder, sent at its reminder_time.
+
+    The event ID is a resume cursor; EventSource sends it back as
+    Last-Event-ID on reconnect (or pass ?cursor=), and reminders sent in
+    between are replayed. /reminders/upcoming polling keeps working as a fallback.
+    """
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+
+    def offer(message):
+        # A client that stops reading is closed instead of buffering without bound
+        messages.put_nowait(message if messages.qsize() < STREAM_QUEUE_SIZE else None)
+
+    token = reminder_dispatcher.subscribe(user_id, lambda message: loop.call_soon_threadsafe(offer, message),
+                                          last_event_id or cursor)
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(messages.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    break
+                yield f"id: {message['id']}\nevent: reminder\ndata: {json.dumps(message['reminder'], default=str)}\n\n"
+        finally:
+            reminder_dispatcher.unsubscribe(user_id, token)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.get("/upcoming")
-def get_upcoming_reminders(user_id: str):
-    # 1. Get user settings
+def get_upcoming_reminders(user_id: str, since: str = None, if_none_match: str = Header(None)):
+    """Reminders due in the next 24h. Supports If-None-Match (304).
+
+    since=<cursor> (empty on the first call) switches to delta mode: only
+    reminders added or changed since that cursor, IDs of removed ones, and the
+    cursor for the next call. full=true means the cursor was unknown and
+    "reminders" is the whole list.
+    """
+    if since is not None:
+        return _upcoming_delta(user_id, since)
+
+    version = conditional.data_version(user_id)
+    unchanged = conditional.not_modified("upcoming", user_id, if_none_match, version)
+    if unchanged:
+        return unchanged
+
+    result = upcoming_reminders(user_id)
+    if result.get("error"):
+        version = None # Never serve a failed read as "not modified"
+    return conditional.respond("upcoming", user_id, result, if_none_match, version, _reminders_valid_until(user_id, result))
+
+
+def _upcoming_delta(user_id, since):
+    version = conditional.data_version(user_id) # The user's change sequence
+    previous = reminder_changes.lookup(user_id, since)
+    if previous and reminder_changes.unchanged(previous, version):
+        return {"reminders": [], "removed": [], "cursor": since, "full": False}
+
+    result = upcoming_reminders(user_id)
+    if result.get("error"):
+        # Keep the client's cursor: its state is still the last good one
+        return {"reminders": [], "removed": [], "cursor": since or None, "full": False, "error": result["error"]}
+    cursor = reminder_changes.save(user_id, version, result["reminders"], _reminders_valid_until(user_id, result))
+    if previous is None:
+        return {**result, "removed": [], "cursor": cursor, "full": True}
+    changed, removed = reminder_changes.diff(previous, result["reminders"])
+    return {"reminders": changed, "removed": removed, "settings": result["settings"], "cursor": cursor, "full": False}
+
+
+def _reminders_valid_until(user_id, result):
+    """When the upcoming list changes without any DB write (epoch seconds), or None.
+
+    A reminder flips to trigger_immediately at its reminder_time and drops out
+    60s later; an event beyond the 24h window enters it 24h before it starts.
+    """
+    now = datetime.now(timezone.utc)
+    next_24h = now + timedelta(hours=24)
+    times = []
+    for reminder in result.get("reminders", []):
+        reminder_time = datetime.fromisoformat(reminder["reminder_time"])
+        times.append(reminder_time if reminder_time > now else reminder_time + timedelta(seconds=60))
+    inputs = _reminder_inputs(user_id, now)
+    if inputs.get("error"):
+        return now.timestamp() # Unknown: do not reuse this response
+    rows = inputs["stored"] if "stored" in inputs else inputs["events"]
+    starts = [start for start in (_event_start(row) for row in rows) if start and start > next_24h]
+    if inputs["next_start"]:
+        starts.append(recurrence.sort_key(inputs["next_start"]))
+    if starts:
+        times.append(min(starts) - timedelta(hours=24))
+    return min(times).timestamp() if times else None
+
+
+def _reminder_inputs(user_id, now):
+    """Settings, account map and events upcoming_reminders works from, via the read cache.
+
+    Events are loaded for an hour-aligned window wide enough for any `now`
+    in that hour, so every poll within the hour shares one entry. The queries
+    do not depend on each other and run concurrently (_fetch_all); account
+    emails come embedded in the event rows.
+    Returns a dict with offsets, sound, account_map and events, or with error.
+    """
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    key = ("upcoming", hour.isoformat())
+    cached = read_cache.get(user_id, key)
+    if cached is not None:
+        return cached
+    generation = read_cache.generation(user_id)
+
+    # 1. User settings (usually from memory, see services/settings_store.py), alongside the events
+    settings_future = _fetch_pool.submit(settings_store.get, user_id)
+
+    # 2. Upcoming events (next 24 hours + recent past for missed reminders), for the whole hour
+    window_start = hour - timedelta(hours=2)
+    window_end = hour + timedelta(hours=25)
+    inputs = None
+    # Stored rows only when they are complete for the window (not after a failed materialization)
+    if reminder_store.covers(user_id, window_end):
+        inputs = _stored_reminder_inputs(user_id, hour, window_start, window_end)
+    if inputs is None:
+        inputs = _event_inputs(user_id, window_start, window_end)
+
     try:
-        settings_response = supabase.table("alarm_settings").select("*").eq("user_id", user_id).execute()
+        settings = settings_future.result()
     except Exception as e:
         print(f"DB Error getting settings: {e}")
-        return {"reminders": [], "error": "Settings fetch failed"}
-    
-    offsets = [30]
-    sound = "default"
-    
-    if settings_response.data:
-        data = settings_response.data[0]
-        # Robustly handle missing or empty list
-        db_offsets = data.get("reminder_offsets")
-        if db_offsets and isinstance(db_offsets, list) and len(db_offsets) > 0:
-            offsets = db_offsets
-        else:
-             # Fallback to legacy field
-             offsets = [data.get("global_reminder_offset_minutes", 30)]
-        sound = data.get("default_alarm_sound", "default")
-    
-    # 2. Get connected accounts map (id -> email)
+        return {"error": "Settings fetch failed"}
+    if inputs.get("error"):
+        return inputs
+
+    # 3. Connected accounts map (id -> email), from the embedded connected_accounts(email)
+    rows = inputs["stored"] if "stored" in inputs else inputs["events"]
     account_map = {}
+    for row in rows:
+        event = (row.get("events") or {}) if "stored" in inputs else row
+        account = event.get("connected_accounts")
+        if account and account.get("email") and event.get("account_id"):
+            account_map[event["account_id"]] = account.get("email")
+
+    inputs.update({
+        "offsets": settings_store.offsets(settings),
+        "sound": settings.get("default_alarm_sound") or "default",
+        "account_map": account_map
+    })
+    read_cache.set(user_id, key, inputs, generation, expires_at=(hour + timedelta(hours=1)).timestamp())
+    return inputs
+
+
+def _fetch_all(*calls):
+    """Starts the calls on the fetch pool at once; returns their futures, in order."""
+    return [_fetch_pool.submit(call) for call in calls]
+
+
+def _event_inputs(user_id, window_start, window_end):
+    """{"events": rows, "next_start": ...} computed from the events table, or {"error": ...}."""
+    def window_events():
+        query = supabase.table("events")\
+            .select(f"*, {ACCOUNT_EMBED}")\
+            .eq("user_id", user_id)\
+            .gte("start_time", window_start.isoformat())\
+            .lte("start_time", window_end.isoformat())
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            # Series are expanded below; cancelled instances only mark what to skip
+            query = query.is_("recurrence", "null").eq("is_cancelled", False)
+        return query.execute().data
+
+    def window_instances():
+        return recurrence.load_instances(user_id, window_start, window_end + timedelta(seconds=1),
+                                         columns=f"*, {ACCOUNT_EMBED}")
+
+    # First start after the window: when the next event enters it (see _reminders_valid_until)
+    def next_event():
+        query = supabase.table("events").select("start_time")\
+            .eq("user_id", user_id)\
+            .gt("start_time", window_end.isoformat())
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            query = query.is_("recurrence", "null").eq("is_cancelled", False)
+        return query.order("start_time").limit(1).execute().data or []
+
+    def next_instances():
+        return recurrence.load_instances(user_id, window_end, window_end + timedelta(days=1))
+
+    if recurrence.SYNC_RECURRENCE_MASTERS:
+        events_f, instances_f, next_f, next_instances_f = _fetch_all(window_events, window_instances, next_event, next_instances)
+    else:
+        events_f, next_f = _fetch_all(window_events, next_event)
+
+    try:
+        events = events_f.result()
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            events = events + instances_f.result()
+    except Exception as e:
+         print(f"DB Error getting events: {e}")
+         return {"error": "Events fetch failed"}
+
     try:
-        accounts_resp = supabase.table("connected_accounts").select("id, email").eq("user_id", user_id).execute()
-        for acc in accounts_resp.data:
-            account_map[acc['id']] = acc['email']
+        starts = [row["start_time"] for row in next_f.result()]
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            starts += [row["start_time"] for row in next_instances_f.result()]
+        next_start = min(starts, key=recurrence.sort_key) if starts else None
     except Exception as e:
-        print(f"DB Error getting accounts: {e}")
+        print(f"DB Error getting next event: {e}")
+        return {"error": "Next event fetch failed"}
+
+    return {"events": events, "next_start": next_start}
+
+
+def _stored_reminder_inputs(user_id, hour, window_start, window_end):
+    """Materialized, not dismissed reminders of the window (services/reminder_store.py).
+
+    Returns {"stored": rows, "next_start": ...}, or None to compute them from events instead.
+    """
+    def window_rows():
+        return supabase.table("reminders")\
+            .select(f"id, event_id, reminder_time, minutes_before, occurrence_start, events(title, account_id, meeting_link, recurrence, {ACCOUNT_EMBED})")\
+            .eq("user_id", user_id)\
+            .eq("is_dismissed", False)\
+            .gt("reminder_time", (hour - timedelta(seconds=60)).isoformat())\
+            .gte("occurrence_start", window_start.isoformat())\
+            .lte("occurrence_start", window_end.isoformat())\
+            .order("reminder_time")\
+            .execute().data or []
 
-    # 3. Get upcoming events (next 24 hours + recent past for missed reminders)
+    def next_row():
+        return supabase.table("reminders").select("occurrence_start")\
+            .eq("user_id", user_id)\
+            .eq("is_dismissed", False)\
+            .gt("occurrence_start", window_end.isoformat())\
+            .order("occurrence_start").limit(1).execute().data or []
+
+    rows_f, after_f = _fetch_all(window_rows, next_row)
+    try:
+        rows = rows_f.result()
+        after = after_f.result()
+    except Exception as e:
+        print(f"DB Error getting stored reminders, computing from events: {e}")
+        return None
+    # _event_start() reads start_time
+    stored = [{**row, "start_time": row["occurrence_start"]} for row in rows]
+    return {"stored": stored, "next_start": after[0]["occurrence_start"] if after else None}
+
+
+def _event_start(event):
+    try:
+        return recurrence.sort_key(event["start_time"])
+    except Exception:
+        return None
+
+
+def _stored_reminders(inputs, now, lookback_time, next_24h):
+    """The response rows for materialized reminders (see _stored_reminder_inputs)."""
+    reminders = []
+    for row in inputs["stored"]:
+        start_time = recurrence.sort_key(row["occurrence_start"])
+        reminder_time = recurrence.sort_key(row["reminder_time"])
+        diff_seconds = (reminder_time - now).total_seconds()
+        if not (lookback_time <= start_time <= next_24h) or diff_seconds <= -60:
+            continue
+        event = row.get("events") or {}
+        event_id = row["event_id"]
+        if event.get("recurrence"):
+            # Same ID as the expanded instance in /calendar/events
+            event_id = f"{event_id}_{start_time.strftime('%Y%m%dT%H%M%SZ')}"
+        reminders.append({
+            "id": f"{event_id}_{row['minutes_before']}", # Unique ID for each reminder instance
+            "reminder_id": row["id"], # For POST /reminders/dismiss/{reminder_id}
+            "event_id": event_id,
+            "title": event.get("title"),
+            "start_time": row["occurrence_start"],
+            "reminder_time": reminder_time.isoformat(),
+            "minutes_before": row["minutes_before"],
+            "sound": inputs["sound"],
+            "account_id": event.get('account_id'),
+            "account_email": inputs["account_map"].get(event.get('account_id'), "Unknown Email"),
+            "meeting_link": event.get("meeting_link"),
+            "trigger_immediately": diff_seconds <= 0 # Flag for frontend
+        })
+    return reminders
+
+
+def upcoming_reminders(user_id):
     # Use timezone-aware UTC
     now = datetime.now(timezone.utc)
     lookback_time = now - timedelta(hours=2) # Look back to find active/recent events
     next_24h = now + timedelta(hours=24)
+
+    try:
+        # First read of a user, or the materialized horizon is close
+        reminder_store.ensure_materialized(user_id)
+    except Exception as e:
+        print(f"DB Error materializing reminders: {e}")
+
+    inputs = _reminder_inputs(user_id, now)
+    if inputs.get("error"):
+        return {"reminders": [], "error": inputs["error"]}
+    offsets = inputs["offsets"]
+    sound = inputs["sound"]
+    account_map = inputs["account_map"]
+
+    if "stored" in inputs:
+        reminders = _stored_reminders(inputs, now, lookback_time, next_24h)
+        print(f"DEBUG: {len(reminders)} stored reminders for user {user_id}")
+        return {"reminders": reminders, "settings": {"offsets": offsets, "sound": sound}}
     
     print(f"DEBUG: Checking reminders for user {user_id}")
     print(f"DEBUG: Server Time (UTC): {now.isoformat()}")
     print(f"DEBUG: Offsets: {offsets}")
-    
-    try:
-        events_response = supabase.table("events")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .gte("start_time", lookback_time.isoformat())\
-            .lte("start_time", next_24h.isoformat())\
-            .execute()
-    except Exception as e:
-         print(f"DB Error getting events: {e}")
-         return {"reminders": [], "error": "Events fetch failed"}
-        
-    print(f"DEBUG: Found {len(events_response.data)} upcoming events")
 
     reminders = []
     try:
-        for event in events_response.data:
-            # DEBUG RAW OFFSETS
-            print(f"DEBUG: Event '{event.get('title')}' (ID: {event.get('google_event_id')}) RAW OFFSETS: {event.get('reminder_offsets')}")
-
-            # start_time is already ISO with timezone from DB (timestamptz)
-            # normalize it to ensure python treats it as aware
-            try:
-                start_iso = event["start_time"]
-                # Handle YYYY-MM-DD (All Day)
-                if 'T' not in start_iso and len(start_iso) == 10:
-                    start_iso = f"{start_iso}T09:00:00+00:00" # Default All Day to 9 AM UTC? Or user TZ?
-                    # Better: Just parse as day and set TZ.
-                    
-                # Handle Z by replacing with +00:00 for valid isoformat
-                start_iso = start_iso.replace('Z', '+00:00')
-                start_time = datetime.fromisoformat(start_iso)
-                
-                # Double check: if naive, assume UTC
-                if start_time.tzinfo is None:
-                     start_time = start_time.replace(tzinfo=timezone.utc)
-            except Exception as e:
-                # Fallback if parsing fails
-                print(f"DEBUG: Error parsing date for '{event.get('title')}': {e} (Raw: {event.get('start_time')})")
+        # Parse every start once; the events x offsets expansion is batched (services/reminder_expansion.py)
+        events, starts, event_offsets = [], [], []
+        for event in inputs["events"]:
+            start_time = _event_start(event)
+            if start_time is None:
+                print(f"DEBUG: Error parsing date for '{event.get('title')}' (Raw: {event.get('start_time')})")
                 continue
-            
-            # Determine which offsets to use for THIS event
-            event_offsets = offsets # Default to global
-            
-            # Check for per-event override
-            # Explicitly check for None to allow [] (No Reminders) to work if user enabled it.
-            # But if user complains about 'not coming', maybe they want valid list.
-            if event.get("reminder_offsets") is not None:
-                event_offsets = event["reminder_offsets"]
-                # print(f"DEBUG: Event '{event['title']}' using CUSTOM offsets: {event_offsets}")
-            
-            # Generate a reminder for EACH offset
-            for minutes in event_offsets:
-                reminder_time = start_time - timedelta(minutes=minutes)
-                
-                # Check diff (both are aware now)
-                diff_seconds = (reminder_time - now).total_seconds()
-                
-                # Logic: Return if it's in the future OR if it's "TRIGGER TIME" (within last minute)
-                if diff_seconds > -60: 
-                    # Add detailed debug for specific near-term events
-                    # if diff_seconds < 300: # 5 mins
-                    #      print(f"DEBUG: Event '{event['title']}' with offset {minutes} is due in {diff_seconds}s")
-
-                    reminders.append({
-                        "id": f"{event['id']}_{minutes}", # Unique ID for each reminder instance
-                        "event_id": event["id"],
-                        "title": event["title"],
-                        "start_time": event["start_time"],
-                        "reminder_time": reminder_time.isoformat(),
-                        "minutes_before": minutes,
-                        "sound": sound,
-                        "account_id": event.get('account_id'),
-                        "account_email": account_map.get(event.get('account_id'), "Unknown Email"), 
-                        "meeting_link": event.get("meeting_link"),
-                        "trigger_immediately": diff_seconds <= 0 and diff_seconds > -60 # Flag for frontend
-                    })
-                else:
-                    pass
-                    # if diff_seconds > -600: # Log things we JUST missed
-                    #      print(f"DEBUG: Skipped '{event['title']}' offset {minutes} (Diff: {diff_seconds}s - Too old)")
+            if not (lookback_time <= start_time <= next_24h):
+                continue
+            if len(event["start_time"]) == 10:
+                start_time += timedelta(hours=9) # All day (YYYY-MM-DD): 9 AM UTC
+            events.append(event)
+            starts.append(reminder_expansion.epoch(start_time))
+            # Per-event override; None means the user's defaults, [] means no reminders
+            event_offsets.append(event["reminder_offsets"] if event.get("reminder_offsets") is not None else offsets)
+
+        print(f"DEBUG: Found {len(events)} upcoming events")
+
+        now_seconds = now.timestamp()
+        # Return if it's in the future OR if it's "TRIGGER TIME" (within last minute)
+        for i, minutes, reminder_seconds in reminder_expansion.expand(starts, event_offsets, after=now_seconds - 60):
+            event = events[i]
+            reminders.append({
+                "id": f"{event['id']}_{minutes}", # Unique ID for each reminder instance
+                "event_id": event["id"],
+                "title": event["title"],
+                "start_time": event["start_time"],
+                "reminder_time": reminder_expansion.isoformat(reminder_seconds),
+                "minutes_before": minutes,
+                "sound": sound,
+                "account_id": event.get('account_id'),
+                "account_email": account_map.get(event.get('account_id'), "Unknown Email"),
+                "meeting_link": event.get("meeting_link"),
+                "trigger_immediately": reminder_seconds <= now_seconds # Flag for frontend
+            })
 
     except Exception as e:
         print(f"CRITICAL ERROR in get_upcoming_reminders: {e}")
@@ -276,5 +680,5 @@ def get_upcoming_reminders(user_id: str):
         return {"reminders": [], "settings": {"offsets": offsets, "sound": sound}, "error": str(e)}
 
     return {"reminders": reminders, "settings": {"offsets": offsets, "sound": sound}}
-            
 
+reminder_dispatcher.set_loader(upcoming_reminders)
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import hashlib
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from services.supabase_client import supabase
+from services.cache import TTLCache
+from services.postgrest import is_missing_function
+
+# Conditional GETs (ETag / If-None-Match -> 304) for the polled read endpoints
+# The ETag is a hash of the response body. After computing a body we remember
+# (etag, data version, valid_until) per user; a later request that sends the
+# same ETag gets a 304 after one tiny user_data_version RPC (migrations/09),
+# as long as the data version is unchanged and the response has not "aged"
+# (e.g. a reminder became due). Without the RPC the body is always computed
+# and only the transfer is saved.
+ETAG_MAX_VALID_SECONDS = int(os.getenv("ETAG_MAX_VALID_SECONDS", "3600"))
+ETAG_STATE_SIZE = int(os.getenv("ETAG_STATE_SIZE", "4096"))
+
+_states = TTLCache(maxsize=ETAG_STATE_SIZE, ttl=ETAG_MAX_VALID_SECONDS) # (endpoint, user_id) -> state
+_version_rpc_available = True # Flipped off if the user_data_version migration is not applied
+
+
+def data_version(user_id):
+    """Returns the user's data version string, or None if it cannot be determined."""
+    global _version_rpc_available
+    if not _version_rpc_available:
+        return None
+    try:
+        return supabase.rpc("user_data_version", {"p_user_id": user_id}).execute().data
+    except Exception as e:
+        if is_missing_function(e):
+            print("user_data_version RPC not found (migration 09 missing). ETags fall back to body hashes.")
+            _version_rpc_available = False
+        else:
+            print(f"user_data_version RPC failed: {e}")
+        return None
+
+
+def etag_for(body):
+    payload = json.dumps(jsonable_encoder(body), sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha1(payload.encode("utf-8")).hexdigest() + '"'
+
+
+def _matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def not_modified(endpoint, user_id, if_none_match, version):
+    """Returns a 304 response if the client's ETag is still current, else None.
+
+    Call with the current data_version() before computing the body.
+    """
+    if not if_none_match or version is None:
+        return None
+    state = _states.get((endpoint, user_id))
+    if not state or time.time() >= state["valid_until"] or not _matches(if_none_match, state["etag"]):
+        return None
+    if version != state["version"]:
+        return None
+    return Response(status_code=304, headers={"ETag": state["etag"], "Cache-Control": "no-cache"})
+
+
+def respond_with_etag(etag, body, if_none_match):
+    """304 or 200 for a body whose ETag the caller already knows (e.g. from a version number)."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
+
+def respond(endpoint, user_id, body, if_none_match, version, valid_until=None):
+    """Builds the response for a computed body: 304 if the client already has it, else 200 + ETag.
+
+    version must be read BEFORE the body was computed, so a write that races
+    the computation leaves a stale version behind and forces a recompute.
+    valid_until (epoch seconds) is when the body changes even without writes.
+    """
+    etag = etag_for(body)
+    if version is not None:
+        valid_until = min(valid_until or float("inf"), time.time() + ETAG_MAX_VALID_SECONDS)
+        _states.set((endpoint, user_id), {"etag": etag, "version": version, "valid_until": valid_until})
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+from services.supabase_client import supabase
+from services.postgrest import PAGE_SIZE, chunks
+
+# Diff-based persistence for synced events
+# Only rows whose content_hash changed are written, in bounded-size chunks,
+# so DB write volume scales with churn rather than calendar size.
+EVENT_UPSERT_CHUNK_SIZE = int(os.getenv("EVENT_UPSERT_CHUNK_SIZE", "200"))
+
+# Columns that make up an event's content. updated_at is deliberately excluded.
+HASHED_FIELDS = (
+    "title", "description", "start_time", "end_time", "is_all_day",
+    "location", "html_link", "meeting_link"
+)
+# Only present in recurrence-masters mode; left out otherwise so existing hashes stay valid
+SERIES_FIELDS = ("recurrence", "recurrence_end", "recurring_event_id", "original_start_time", "is_cancelled")
+
+
+def content_hash(record):
+    values = [record.get(field) for field in HASHED_FIELDS]
+    if "recurrence" in record:
+        values += [record.get(field) for field in SERIES_FIELDS]
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_stored_hashes(account_id, google_event_ids=None, window=None, masters=False):
+    """Returns {google_event_id: content_hash} for an account.
+
+    Either for the given IDs (incremental sync) or for every row starting inside
+    window = (start, end or None) (full sync, needed to find events that disappeared).
+    masters=True returns every recurrence master instead, wherever its first instance starts.
+    """
+    stored = {}
+    if google_event_ids is not None:
+        for ids in chunks(list(google_event_ids)):
+            resp = supabase.table("events").select("google_event_id, content_hash")\
+                .eq("account_id", account_id)\
+                .in_("google_event_id", ids)\
+                .execute()
+            for row in resp.data or []:
+                stored[row["google_event_id"]] = row.get("content_hash")
+        return stored
+
+    offset = 0
+    while True:
+        query = supabase.table("events").select("google_event_id, content_hash").eq("account_id", account_id)
+        if masters:
+            query = query.not_.is_("recurrence", "null")
+        elif window and window[0]:
+            query = query.gte("start_time", window[0])
+        if window and window[1] and not masters:
+            query = query.lt("start_time", window[1])
+        resp = query.order("google_event_id").range(offset, offset + PAGE_SIZE - 1).execute()
+        rows = resp.data or []
+        for row in rows:
+            stored[row["google_event_id"]] = row.get("content_hash")
+        if len(rows) < PAGE_SIZE:
+            return stored
+        offset += PAGE_SIZE
+
+
+def delete_events(account_id, google_event_ids, with_series=False):
+    """Deletes rows by google_event_id; with_series also deletes the exception rows of deleted series."""
+    deleted = 0
+    for ids in chunks(list(google_event_ids)):
+        supabase.table("events").delete().eq("account_id", account_id).in_("google_event_id", ids).execute()
+        if with_series:
+            supabase.table("events").delete().eq("account_id", account_id).in_("recurring_event_id", ids).execute()
+        deleted += len(ids)
+    return deleted
+
+
+def persist_page(account_id, records, cancelled_ids=(), with_series=False):
+    """Writes one page of an account's synced events, touching only what changed.
+
+    records: events.* rows built by the sync (without content_hash).
+    cancelled_ids: tombstones from an incremental sync.
+    Only the stored hashes of this page's IDs are loaded, so memory tracks page size.
+    Raises on DB errors so the caller can keep the old sync token.
+    """
+    for record in records:
+        record["content_hash"] = content_hash(record)
+
+    fetched_ids = {r["google_event_id"] for r in records}
+    stored = load_stored_hashes(account_id, google_event_ids=fetched_ids) if fetched_ids else {}
+
+    changed = [r for r in records if stored.get(r["google_event_id"]) != r["content_hash"]]
+    for chunk in chunks(changed, EVENT_UPSERT_CHUNK_SIZE):
+        supabase.table("events").upsert(chunk, on_conflict="account_id, google_event_id").execute()
+
+    to_delete = set(cancelled_ids) - fetched_ids
+    deleted = delete_events(account_id, sorted(to_delete), with_series) if to_delete else 0
+
+    return {
+        "written": len(changed),
+        "unchanged": len(records) - len(changed),
+        "deleted": deleted,
+        "changed_ids": [r["google_event_id"] for r in changed]
+    }
+
+
+def delete_missing(account_id, window, seen_ids, with_series=False):
+    """After a full sync, deletes stored rows in window = (start, end or None) that Google no longer returned.
+
+    with_series also checks recurrence masters, whose first instance usually lies before the window.
+    """
+    stored = load_stored_hashes(account_id, window=window)
+    if with_series:
+        stored.update(load_stored_hashes(account_id, masters=True))
+    missing = set(stored) - set(seen_ids)
+    return delete_events(account_id, sorted(missing), with_series) if missing else 0
+
@@ -0,0 +1,516 @@
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from services.supabase_client import supabase
+from services import http_client, token_store, event_store, meeting_links, recurrence, reminder_store
+from services.singleflight import SingleFlight
+from services.read_cache import read_cache
+
+# Google Calendar sync engine
+# Shared by the /calendar/fetch-from-google endpoint and the background scheduler.
+SYNC_MAX_CONCURRENCY = int(os.getenv("SYNC_MAX_CONCURRENCY", "4")) # Accounts fetched in parallel per user
+
+SYNC_FRESH_SECONDS = int(os.getenv("SYNC_FRESH_SECONDS", "15")) # Serve a just-finished sync again instead of redoing it
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "250")) # Events per Google page; bounds per-account sync memory
+SYNC_QUEUE_PAGES = 4 # Normalized pages buffered between fetch workers and the consumer
+
+SYNC_HORIZON_DAYS = int(os.getenv("SYNC_HORIZON_DAYS", "365")) # timeMax for full syncs; 0 = unbounded
+
+GOOGLE_EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+
+# Event fields the mapper reads. The `fields=` projection sent to Google is built
+# from this tuple, and normalize_item only sees a ProjectedEvent, so reading a
+# field that is not listed here fails loudly instead of silently getting None.
+EVENT_FIELDS = (
+    "id", "status", "summary", "description", "location",
+    "start", "end", "htmlLink", "hangoutLink", "conferenceData",
+    "recurrence", "recurringEventId", "originalStartTime"
+)
+FIELD_PROJECTIONS = {"conferenceData": "conferenceData(entryPoints(entryPointType,uri))"}
+LIST_FIELDS = f"items({','.join(FIELD_PROJECTIONS.get(f, f) for f in EVENT_FIELDS)}),nextPageToken,nextSyncToken"
+
+# Overlapping syncs for the same user (Home screen, background fetch, manual refresh)
+# join the one in flight. Keys are (user_id, ...).
+user_sync_flight = SingleFlight(fresh_for=SYNC_FRESH_SECONDS)
+
+
+def sync_window():
+    """Returns (time_min, time_max) for full syncs. time_max is None when unbounded."""
+    # Time Min start of today UTC
+    # Use simple naive UTC + 'Z' to satisfy Google API
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    time_min = start.isoformat() + 'Z'
+    time_max = (start + timedelta(days=SYNC_HORIZON_DAYS)).isoformat() + 'Z' if SYNC_HORIZON_DAYS > 0 else None
+    return time_min, time_max
+
+
+class ProjectedEvent(dict):
+    """A Google event resource limited to EVENT_FIELDS."""
+
+    def _check(self, key):
+        if key not in EVENT_FIELDS:
+            raise KeyError(f"Event field '{key}' is not requested from Google; add it to EVENT_FIELDS")
+
+    def __getitem__(self, key):
+        self._check(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._check(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._check(key)
+        return super().__contains__(key)
+
+
+def source_from_account(acc):
+    """Builds a sync source from a connected_accounts row."""
+    return {
+        'token': acc.get('access_token'),
+        'refresh_token': acc.get('refresh_token'),
+        'email': acc.get('email'),
+        'id': acc.get('id'),
+        'token_expires_at': acc.get('token_expires_at'),
+        'sync_token': acc.get('sync_token'),
+        'is_primary': False
+    }
+
+
+def iter_event_pages(source, window, outcome, sync_token=None):
+    """Yields one account's event items page by page.
+
+    Full syncs request the (time_min, time_max) window. With a sync_token only
+    the changes since that token are requested (Google does not allow
+    timeMin/timeMax/orderBy together with syncToken).
+    Only LIST_FIELDS are requested (partial response).
+    When iteration ends, outcome holds "status_code" and "next_sync_token".
+    A 410 means the token expired.
+    """
+    source_email = source.get('email', 'Unknown')
+    token = token_store.get_access_token(source) # Refreshes ahead of expiry
+    refreshed = False
+    page_token = None
+    outcome.update({"status_code": None, "next_sync_token": None})
+
+    while True:
+        # Masters mode: one item per series instead of one per instance (see services/recurrence.py)
+        single_events = "false" if recurrence.SYNC_RECURRENCE_MASTERS else "true"
+        params = {"singleEvents": single_events, "maxResults": SYNC_PAGE_SIZE, "fields": LIST_FIELDS}
+        if sync_token:
+            params["syncToken"] = sync_token
+        else:
+            params["timeMin"] = window[0]
+            if window[1]:
+                params["timeMax"] = window[1]
+        if page_token:
+            params["pageToken"] = page_token
+
+        headers = {'Authorization': f'Bearer {token}'}
+        print(f"[{source_email}] Requesting page...")
+        try:
+            response = http_client.get(GOOGLE_EVENTS_URL, headers=headers, params=params)
+        except Exception as e:
+            print(f"[{source_email}] Network error fetching events: {e}")
+            outcome["status_code"] = 503
+            return
+
+        if response.status_code == 401:
+            if source.get('refresh_token') and not refreshed:
+                print(f"[{source_email}] Token 401. Attempting refresh...")
+                refreshed = True
+                new_token = token_store.refresh(source, stale_token=token)
+                if new_token:
+                    token = new_token # Retry the same page with the new token
+                    continue
+                print(f"[{source_email}] Refresh failed. Abort.")
+            outcome["status_code"] = 401
+            return
+
+        if response.status_code != 200:
+            print(f"[{source_email}] Google API Error: {response.status_code} {response.text}")
+            outcome["status_code"] = response.status_code
+            return
+
+        data = response.json()
+        page_token = data.get('nextPageToken')
+        yield data.get('items', [])
+
+        if not page_token:
+            # nextSyncToken is only present on the last page
+            outcome.update({"status_code": 200, "next_sync_token": data.get('nextSyncToken')})
+            return
+
+
+def normalize_item(item, source_email):
+    """Maps a Google event resource to (event_obj for the app, db_record fields)."""
+    item = ProjectedEvent(item)
+    start_raw = item.get('start', {}).get('dateTime') or item.get('start', {}).get('date')
+    end_raw = item.get('end', {}).get('dateTime') or item.get('end', {}).get('date')
+
+    # Formatting time string for UI
+    try:
+        # Simple parse
+        if 'T' in start_raw:
+            # Is ISO format with likely offset or Z
+            # We just want a simple HH:MM AM/PM representation
+            dt = datetime.fromisoformat(start_raw.replace('Z', '+00:00'))
+            time_str = dt.strftime("%I:%M %p")
+        else:
+            # Full day
+            time_str = "All Day"
+    except:
+        time_str = start_raw
+
+    # Extract Meeting Link
+    meeting_link = meeting_links.from_event(item)
+
+    event_obj = {
+        'id': item.get('id'),
+        'title': item.get('summary', '(No Title)'),
+        'start': start_raw,
+        'end': end_raw,
+        'time': time_str,
+        'link': item.get('htmlLink'),
+        'meeting_link': meeting_link,
+        'source': source_email,
+        'calendar': 'Google',
+        'color': '#4F46E5'
+    }
+
+    db_record = None
+    if start_raw and end_raw:
+        db_record = {
+            "google_event_id": item['id'],
+            "title": item.get('summary', '(No Title)'),
+            "description": item.get('description', ''),
+            "start_time": start_raw,
+            "end_time": end_raw,
+            "is_all_day": 'date' in item.get('start', {}),
+            "location": item.get('location'),
+            "html_link": item.get('htmlLink'),
+            "meeting_link": meeting_link,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        if recurrence.SYNC_RECURRENCE_MASTERS:
+            db_record.update(series_columns(item, start_raw, end_raw))
+            event_obj['recurrence'] = db_record['recurrence']
+    return event_obj, db_record
+
+
+def series_columns(item, start_raw, end_raw):
+    """Recurrence columns of an events row (masters mode only)."""
+    columns = {"recurrence": None, "recurrence_end": None, "recurring_event_id": None, "original_start_time": None, "is_cancelled": False}
+    if item.get('recurrence'):
+        lines = recurrence.rule_lines(item['start'], item['recurrence'])
+        duration = datetime.fromisoformat(end_raw.replace('Z', '+00:00')) - datetime.fromisoformat(start_raw.replace('Z', '+00:00'))
+        columns["recurrence"] = lines
+        columns["recurrence_end"] = recurrence.series_end(lines, duration)
+    if item.get('recurringEventId'):
+        original = item.get('originalStartTime') or {}
+        columns["recurring_event_id"] = item['recurringEventId']
+        columns["original_start_time"] = original.get('dateTime') or original.get('date')
+    return columns
+
+
+def cancelled_instance_record(item):
+    """Exception row for a cancelled instance of a series (masters mode only).
+
+    Stored, not deleted, so the expansion knows to skip that instance.
+    """
+    original = item.get('originalStartTime') or {}
+    original_start = original.get('dateTime') or original.get('date')
+    if not original_start:
+        return None
+    return {
+        "google_event_id": item['id'],
+        "title": None,
+        "description": None,
+        "start_time": original_start,
+        "end_time": original_start,
+        "is_all_day": 'date' in original,
+        "location": None,
+        "html_link": None,
+        "meeting_link": None,
+        "updated_at": datetime.utcnow().isoformat(),
+        "recurrence": None,
+        "recurrence_end": None,
+        "recurring_event_id": item['recurringEventId'],
+        "original_start_time": original_start,
+        "is_cancelled": True
+    }
+
+
+def normalize_page(user_id, source, items, incremental):
+    """Normalizes one page of Google items.
+
+    Returns (events for the app, events.* records to persist, cancelled google_event_ids).
+    """
+    source_email = source.get('email', 'Unknown')
+    events = []
+    records = []
+    cancelled_ids = []
+
+    for item in items:
+        # Skip cancelled (in incremental mode these are tombstones to delete)
+        if item.get('status') == 'cancelled':
+            item = ProjectedEvent(item)
+            if recurrence.SYNC_RECURRENCE_MASTERS and item.get('recurringEventId'):
+                db_record = cancelled_instance_record(item) if source['id'] else None
+                if db_record:
+                    db_record["user_id"] = user_id
+                    db_record["account_id"] = source['id']
+                    records.append(db_record)
+            elif incremental:
+                cancelled_ids.append(item['id'])
+            continue
+
+        event_obj, db_record = normalize_item(item, source_email)
+        events.append(event_obj)
+
+        # DB Upsert Preparation
+        # Persist ALL accounts now since we have valid IDs
+        if source['id']:
+            if not db_record:
+                print(f"Skipping event {item.get('id')} due to missing dates.")
+                continue
+            db_record["user_id"] = user_id
+            db_record["account_id"] = source['id']
+            records.append(db_record)
+
+    return events, records, cancelled_ids
+
+
+def store_sync_token(account_id, sync_token, next_sync_token):
+    # Skip the write when Google handed back the token we sent (nothing changed)
+    if next_sync_token and next_sync_token != sync_token:
+        try:
+            supabase.table("connected_accounts").update({"sync_token": next_sync_token}).eq("id", account_id).execute()
+        except Exception as e:
+            print(f"Failed to store sync token for account {account_id}: {e}")
+
+
+def _refresh_reminders(user_id, account_id, google_event_ids):
+    # Deleted events take their reminders with them (ON DELETE CASCADE).
+    # The next sync only passes rows that change again, so a failure re-materializes the user on the next read.
+    try:
+        reminder_store.refresh_synced(user_id, account_id, google_event_ids)
+    except Exception as e:
+        print(f"Failed to refresh reminders for account {account_id}: {e}")
+        reminder_store.mark_stale(user_id)
+
+
+def sync_source(user_id, source, window, emit, sync_token=None):
+    """Syncs one source page by page: fetch -> normalize -> persist -> emit.
+
+    Each page's events are handed to emit({"type": "events", ...}) and dropped,
+    so memory tracks SYNC_PAGE_SIZE rather than calendar size (a full sync
+    still keeps the set of seen IDs to find deleted events).
+    The new sync token is stored only once every page it covers is stored,
+    otherwise the next incremental sync would skip them.
+    Returns the account summary.
+    """
+    source_email = source.get('email', 'Unknown')
+    account_id = source.get('id')
+    summary = {
+        "email": source_email,
+        "account_id": account_id,
+        "status_code": None,
+        "mode": "incremental" if sync_token else "full",
+        "pages": 0,
+        "event_count": 0,
+        "persist_stats": None,
+        "error": None
+    }
+    stats = {"written": 0, "unchanged": 0, "deleted": 0}
+    seen_ids = set() if account_id and not sync_token else None
+    outcome = {}
+
+    for items in iter_event_pages(source, window, outcome, sync_token):
+        events, records, cancelled_ids = normalize_page(user_id, source, items, bool(sync_token))
+        del items # Drop the raw page before emit() can block on a slow consumer
+
+        # Persist: only new/changed rows are written. After a failed page the
+        # rest is not written; the old sync token makes the next sync retry it.
+        if account_id and not summary["error"]:
+            try:
+                page_stats = event_store.persist_page(account_id, records, cancelled_ids, recurrence.SYNC_RECURRENCE_MASTERS)
+                for key in stats:
+                    stats[key] += page_stats[key]
+                if page_stats["written"] or page_stats["deleted"]:
+                    read_cache.invalidate(user_id)
+                _refresh_reminders(user_id, account_id, page_stats["changed_ids"])
+            except Exception as e:
+                print(f"Persist failed for account {account_id}: {e}")
+                summary["error"] = str(e)
+        if seen_ids is not None:
+            seen_ids.update(r["google_event_id"] for r in records)
+
+        summary["pages"] += 1
+        summary["event_count"] += len(events)
+        emit({"type": "events", "email": source_email, "account_id": account_id, "events": events})
+
+    summary["status_code"] = outcome["status_code"]
+    if summary["status_code"] != 200:
+        print(f"[{source_email}] API Error: {summary['status_code']}")
+        summary["error"] = summary["error"] or f"Google API error {summary['status_code']}"
+        return summary
+
+    print(f"[{source_email}] Success ({summary['mode']}). Found {summary['event_count']} events in {summary['pages']} pages.")
+    if account_id and not summary["error"]:
+        try:
+            if seen_ids is not None:
+                deleted = event_store.delete_missing(account_id, window, seen_ids, recurrence.SYNC_RECURRENCE_MASTERS)
+                stats["deleted"] += deleted
+                if deleted:
+                    read_cache.invalidate(user_id)
+            store_sync_token(account_id, sync_token, outcome["next_sync_token"])
+            summary["persist_stats"] = stats
+            print(f"Persisted account {account_id}: {stats}")
+        except Exception as e:
+            print(f"Persist failed for account {account_id}: {e}")
+            summary["error"] = str(e)
+    return summary
+
+
+def sync_source_group(user_id, group, window, emit, full_sync=False):
+    """Syncs sources that share one Google account, then emits its {"type": "account"} summary.
+
+    Sources are tried in order until one succeeds. Runs on a worker thread and
+    only touches its own sources.
+    """
+    summary = None
+    for source in group:
+        print(f"Fetching for: {source.get('email', 'Unknown')}...")
+
+        # Incremental sync if we have a token from the last successful sync
+        sync_token = None if full_sync else source.get('sync_token')
+        summary = sync_source(user_id, source, window, emit, sync_token)
+
+        if summary["status_code"] == 410 and not summary["pages"]:
+            # Google expired the sync token. Start over with a full sync.
+            print(f"[{source.get('email', 'Unknown')}] Sync token expired. Falling back to full sync.")
+            summary = sync_source(user_id, source, window, emit)
+
+        # Once pages went out, another source would duplicate them
+        if summary["status_code"] == 200 or summary["pages"]:
+            break
+    emit({"type": "account", **summary})
+
+
+class SyncCancelled(Exception):
+    """Raised in fetch workers once the consumer of iter_sync_sources went away."""
+
+
+def _group_sources(sources):
+    # Dedup: a DB account and the session token can be the same Google account.
+    # Sources sharing an email form one group that is fetched once.
+    groups = {}
+    for source in sources:
+        groups.setdefault(source.get('email') or source.get('id'), []).append(source)
+    return list(groups.values())
+
+
+def _event_sort_key(event):
+    return (event.get('start') or '', event.get('id') or '')
+
+
+def iter_sync_sources(user_id, sources, full_sync=False):
+    """Syncs a user's sources, yielding messages as pages are processed.
+
+    Yields {"type": "events", "email", "account_id", "events"} per page and one
+    {"type": "account", "email", "account_id", "status_code", "mode", "pages",
+    "event_count", "persist_stats", "error"} per Google account once it is
+    done. Accounts run concurrently; at most SYNC_QUEUE_PAGES pages wait for
+    the consumer, after that the fetch workers block (backpressure).
+    Events of a failed account may already have been yielded.
+    """
+    window = sync_window()
+    print(f"Fetching events from: {window[0]} to {window[1] or 'open end'}")
+
+    groups = _group_sources(sources)
+    if not groups:
+        return
+    messages = queue.Queue(maxsize=SYNC_QUEUE_PAGES)
+    cancelled = threading.Event()
+
+    def emit(message):
+        while not cancelled.is_set():
+            try:
+                messages.put(message, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise SyncCancelled()
+
+    def run(group):
+        try:
+            sync_source_group(user_id, group, window, emit, full_sync)
+        except SyncCancelled:
+            pass
+        except Exception as e:
+            print(f"Sync failed for {group[0].get('email')}: {e}")
+            try:
+                emit({"type": "account", "email": group[0].get('email', 'Unknown'), "account_id": group[0].get('id'),
+                      "status_code": 500, "mode": None, "pages": 0, "event_count": 0, "persist_stats": None, "error": str(e)})
+            except SyncCancelled:
+                pass
+
+    # Fetch accounts concurrently so latency tracks the slowest account, not the sum
+    workers = max(1, min(SYNC_MAX_CONCURRENCY, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for group in groups:
+                pool.submit(run, group)
+            remaining = len(groups)
+            while remaining:
+                message = messages.get()
+                if message["type"] == "account":
+                    remaining -= 1
+                yield message
+        finally:
+            cancelled.set() # Unblocks workers if the consumer stopped early
+
+
+def sync_sources(user_id, sources, full_sync=False, collect_events=True):
+    """Fetches, normalizes and persists events for a user's sync sources.
+
+    Returns {"events", "upsert_error", "sync_modes", "persist_stats"}.
+    With collect_events=False no events are kept (background syncs), so
+    memory stays bounded by the page pipeline.
+    """
+    all_events = []
+    pending = {} # email -> events of an account that has not finished yet
+    upsert_error = None
+    sync_modes = {} # email -> "full" | "incremental"
+    persist_stats = {} # account_id -> {"written", "unchanged", "deleted"}
+
+    for message in iter_sync_sources(user_id, sources, full_sync):
+        if message["type"] == "events":
+            if collect_events:
+                pending.setdefault(message["email"], []).extend(message["events"])
+            continue
+
+        events = pending.pop(message["email"], [])
+        if message["status_code"] != 200:
+            continue # A failed account contributes no events
+        sync_modes[message["email"]] = message["mode"]
+        all_events.extend(events)
+        if message["persist_stats"] is not None:
+            persist_stats[message["account_id"]] = message["persist_stats"]
+        elif message["error"]:
+            upsert_error = upsert_error or message["error"]
+
+    # Google returns events unordered when orderBy is not set (required for sync tokens).
+    # The tie-breaker keeps the output independent of which account finished first.
+    all_events.sort(key=_event_sort_key)
+
+    return {"events": all_events, "upsert_error": upsert_error, "sync_modes": sync_modes, "persist_stats": persist_stats}
+
+
+def sync_account(account, full_sync=False):
+    """Syncs a single connected_accounts row (used by the background scheduler)."""
+    return sync_sources(account['user_id'], [source_from_account(account)], full_sync, collect_events=False)
@@ -0,0 +1,72 @@
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared HTTP Client for Google APIs (Singleton)
+# One pooled Session keeps TCP+TLS connections to googleapis.com alive across requests.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5")) # Seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+session = requests.Session()
+# Retries are handled below (with jitter), so the adapter itself never retries
+adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+session.headers.update({
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "AlarmSmartCalendar/1.0 (gzip)" # Google only compresses if the UA mentions gzip
+})
+
+
+def _backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honoring Retry-After when Google sends one."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method, url, retry=True, **kwargs):
+    """Sends a request through the pooled session.
+
+    Retries up to HTTP_MAX_RETRIES times on 429/5xx and connection errors.
+    Pass retry=False for calls that must not run twice (authorization code
+    exchange, events.watch): those are only retried when the connection could
+    not be opened, so the request never reached Google.
+    Returns the last response; raises the last exception if every attempt failed to connect.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    retry_errors = (requests.ConnectionError, requests.Timeout) if retry else (requests.ConnectTimeout,)
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, **kwargs)
+        except retry_errors as e:
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            print(f"HTTP {method} {url} failed ({e}). Retrying in {delay:.2f}s...")
+        else:
+            if not retry or response.status_code not in RETRY_STATUSES or attempt >= HTTP_MAX_RETRIES:
+                return response
+            delay = _backoff_delay(attempt, response)
+            print(f"HTTP {method} {url} returned {response.status_code}. Retrying in {delay:.2f}s...")
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
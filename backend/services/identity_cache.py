@@ -0,0 +1,34 @@
+import os
+import hashlib
+from services.cache import TTLCache
+
+# Session token identity cache
+# Maps (user_id, token fingerprint) -> the Google account behind the token, so a
+# repeat sync with the same session token skips userinfo and account lookups.
+# Only a SHA-256 fingerprint of the token is kept in memory. Whether the account
+# is still active is not cached: a disconnect may happen in another process.
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "3600")) # Google access tokens live 1h
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "1024"))
+
+_identities = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL_SECONDS)
+
+
+def fingerprint(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get(user_id, token):
+    """Returns {"email", "account_id"} or None."""
+    return _identities.get((user_id, fingerprint(token)))
+
+
+def remember(user_id, token, email, account_id):
+    _identities.set((user_id, fingerprint(token)), {
+        "email": email,
+        "account_id": account_id
+    })
+
+
+def forget_account(account_id):
+    """Invalidates every cached token that resolved to this account (disconnect / relink)."""
+    return _identities.pop_where(lambda key, identity: identity["account_id"] == account_id)
@@ -0,0 +1,65 @@
+import os
+import re
+
+# Meeting link extraction
+# Used by the Google sync (per event) and by add_meeting_link.py (bulk backfill).
+# Every provider has a plain substring "needle"; its regex only runs when the
+# needle occurs in the text, so most descriptions never reach the regex engine.
+MEETING_LINK_SCAN_CHARS = int(os.getenv("MEETING_LINK_SCAN_CHARS", "20000")) # Long HTML descriptions are cut here
+
+_URL_TAIL = r'[^\s"\'<>]*'
+
+PROVIDERS = (
+    # (name, needle, pattern)
+    ("meet", "meet.google.com", re.compile(r'(?:https?://)?meet\.google\.com/[a-z]{3}-[a-z]{4}-[a-z]{3}', re.IGNORECASE)),
+    ("zoom", "zoom.us", re.compile(r'(?:https?://)?(?:[\w-]+\.)?zoom\.us/(?:j|w|s)/\d+(?:\?pwd=[\w.-]+)?', re.IGNORECASE)),
+    ("teams", "teams.microsoft.com", re.compile(r'(?:https?://)?teams\.microsoft\.com/(?:l/meetup-join/|meet/)' + _URL_TAIL, re.IGNORECASE)),
+    ("teams", "teams.live.com", re.compile(r'(?:https?://)?teams\.live\.com/meet/' + _URL_TAIL, re.IGNORECASE)),
+    ("webex", "webex.com", re.compile(r'(?:https?://)?[\w-]+\.webex\.com/(?:meet/|join/|[\w-]+/j\.php\?)' + _URL_TAIL, re.IGNORECASE)),
+    ("whereby", "whereby.com", re.compile(r'(?:https?://)?whereby\.com/[\w-]+', re.IGNORECASE)),
+    ("jitsi", "meet.jit.si", re.compile(r'(?:https?://)?meet\.jit\.si/[\w-]+', re.IGNORECASE)),
+)
+
+
+def _with_scheme(link):
+    return link if link.lower().startswith('http') else 'https://' + link
+
+
+def from_text(*texts):
+    """Returns the first meeting link found in the given texts (checked in order), or None."""
+    for text in texts:
+        if not text:
+            continue
+        text = text[:MEETING_LINK_SCAN_CHARS]
+        lowered = text.lower()
+        best = None
+        for _, needle, pattern in PROVIDERS:
+            if needle not in lowered:
+                continue
+            match = pattern.search(text)
+            # Earliest link in the text wins, like a single combined regex would
+            if match and (best is None or match.start() < best.start()):
+                best = match
+        if best:
+            return _with_scheme(best.group(0))
+    return None
+
+
+def from_conference_data(conference_data):
+    """Returns the video entry point of a Google conferenceData object, or None."""
+    for entry_point in (conference_data or {}).get('entryPoints') or []:
+        if entry_point.get('entryPointType') == 'video' and entry_point.get('uri'):
+            return entry_point['uri']
+    return None
+
+
+def from_event(item):
+    """Meeting link for a Google event resource.
+
+    Structured data first (hangoutLink, conferenceData), then description and location text.
+    """
+    return (
+        item.get('hangoutLink')
+        or from_conference_data(item.get('conferenceData'))
+        or from_text(item.get('description'), item.get('location'))
+    )
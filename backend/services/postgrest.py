@@ -0,0 +1,14 @@
+# PostgREST limits and helpers shared by everything that queries Supabase
+ID_CHUNK_SIZE = 100 # IDs per IN (...) filter, keeps PostgREST URLs short
+PAGE_SIZE = 1000 # PostgREST default max rows per response
+
+
+def chunks(seq, size=ID_CHUNK_SIZE):
+    """Consecutive slices of a list of at most `size` items (IN filters, batched writes)."""
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def is_missing_function(e):
+    """True if an RPC error means the function does not exist (its migration is not applied)."""
+    return "PGRST202" in str(e) or "Could not find the function" in str(e)
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# Per-user read cache for the polled endpoints (/calendar/events, /reminders/upcoming)
+# Entries are keyed by (user_id, (kind, *window)) and bounded by an estimated
+# byte size (LRU eviction). Writers invalidate a user's entries explicitly:
+# the Google sync, account link/disconnect, reminder overrides and settings.
+# The TTL only covers writes this process cannot see (other instances, manual edits).
+READ_CACHE_MAX_BYTES = int(os.getenv("READ_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+READ_CACHE_TTL_SECONDS = int(os.getenv("READ_CACHE_TTL_SECONDS", "300"))
+
+
+def _size_of(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 4096
+
+
+class ReadCache:
+    def __init__(self, max_bytes=READ_CACHE_MAX_BYTES, ttl=READ_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict() # (user_id, key) -> (expires_at, size, value)
+        self._user_keys = {} # user_id -> set of keys, for invalidation
+        self._generations = {} # user_id -> int, bumped on every invalidation
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._listeners = [] # Called with (user_id, kinds) after every invalidation
+
+    def add_listener(self, listener):
+        """Registers listener(user_id, kinds), e.g. to recompute pushed data when a user's data changes."""
+        self._listeners.append(listener)
+
+    def _drop(self, full_key):
+        _, size, _ = self._data.pop(full_key)
+        self._bytes -= size
+        keys = self._user_keys.get(full_key[0])
+        if keys is not None:
+            keys.discard(full_key[1])
+            if not keys:
+                self._user_keys.pop(full_key[0])
+
+    def generation(self, user_id):
+        """Read before loading; pass to set() so a load that raced a write is not stored."""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get(self, user_id, key):
+        """Cached value or None. Values are shared: treat them as read-only."""
+        full_key = (user_id, key)
+        with self._lock:
+            entry = self._data.get(full_key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    self._drop(full_key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(full_key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, user_id, key, value, generation, expires_at=None):
+        """Stores a value unless the user was invalidated since `generation` was read.
+
+        expires_at (epoch seconds) shortens the TTL for values that age on their own.
+        """
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, expires_at)
+        full_key = (user_id, key)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            if full_key in self._data:
+                self._drop(full_key)
+            self._data[full_key] = (expires, size, value)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, user_id, kinds=None):
+        """Drops a user's entries (only those whose key starts with one of `kinds`, if given)."""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            keys = [key for key in self._user_keys.get(user_id, ()) if kinds is None or key[0] in kinds]
+            for key in keys:
+                self._drop((user_id, key))
+            self.invalidations += 1
+        for listener in self._listeners:
+            try:
+                listener(user_id, kinds)
+            except Exception as e:
+                print(f"Read cache listener failed: {e}")
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+read_cache = ReadCache()
@@ -0,0 +1,208 @@
+import os
+import re
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from dateutil import rrule, tz
+from services.supabase_client import supabase
+from services.cache import TTLCache
+from services.postgrest import chunks
+
+# Recurring-event masters
+# With SYNC_RECURRENCE_MASTERS=true the sync asks Google for singleEvents=false:
+# a series is stored as ONE events row (recurrence = RFC 5545 lines, DTSTART
+# first), modified/cancelled instances as exception rows (recurring_event_id +
+# original_start_time), and instances are expanded here for the window a
+# reader asks for. Needs migrations/08; after switching the flag either way,
+# clear connected_accounts.sync_token so every account does one full sync.
+SYNC_RECURRENCE_MASTERS = os.getenv("SYNC_RECURRENCE_MASTERS", "false").lower() == "true"
+RECURRENCE_EXPAND_DAYS = int(os.getenv("RECURRENCE_EXPAND_DAYS", "365")) # End of open-ended reads (/calendar/events)
+RECURRENCE_CACHE_SIZE = int(os.getenv("RECURRENCE_CACHE_SIZE", "2048"))
+MAX_INSTANCES_PER_SERIES = 1000 # Per window; guards against pathological rules
+
+# (rule lines, bucketed window) -> occurrence datetimes. Windows are widened to
+# whole hours/days so requests a few seconds apart share an entry.
+_expansions = TTLCache(maxsize=RECURRENCE_CACHE_SIZE, ttl=3600)
+
+_UTC_VALUE = re.compile(r'^(EXDATE|RDATE):(\d{8}T\d{6}Z(?:,\d{8}T\d{6}Z)*)$')
+
+
+def _parse_iso(value):
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def sort_key(value):
+    """Sort key for start_time values coming from the DB and from expand()."""
+    return _parse_iso(value)
+
+
+def _dtstart_line(start):
+    """DTSTART line for a Google start object ({"date"} or {"dateTime", "timeZone"})."""
+    if start.get('date'):
+        return f"DTSTART;VALUE=DATE:{start['date'].replace('-', '')}"
+    tz_name = start.get('timeZone') or 'UTC'
+    local = _parse_iso(start['dateTime'])
+    zone = tz.gettz(tz_name)
+    if zone is None:
+        tz_name, zone = 'UTC', timezone.utc
+    return f"DTSTART;TZID={tz_name}:{local.astimezone(zone).strftime('%Y%m%dT%H%M%S')}"
+
+
+def rule_lines(start, recurrence):
+    """Normalized rule lines for a master: DTSTART first, then Google's RRULE/EXRULE/RDATE/EXDATE lines.
+
+    UTC ("...Z") EXDATE/RDATE values are rewritten with TZID=UTC, because
+    dateutil reads a bare "Z" as local time.
+    """
+    lines = [_dtstart_line(start)]
+    for line in recurrence or []:
+        match = _UTC_VALUE.match(line)
+        if match:
+            line = f"{match.group(1)};TZID=UTC:{match.group(2).replace('Z', '')}"
+        lines.append(line)
+    return lines
+
+
+@lru_cache(maxsize=1024)
+def _ruleset(lines):
+    return rrule.rrulestr("\n".join(lines), forceset=True)
+
+
+def _is_all_day(lines):
+    return lines[0].startswith("DTSTART;VALUE=DATE:")
+
+
+def _comparable(moment, all_day):
+    # All-day rules yield naive dates, timed rules aware datetimes
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if all_day else moment
+
+
+def series_end(lines, duration):
+    """ISO end of the last instance, or None if the series never ends."""
+    lines = tuple(lines)
+    rules = [line for line in lines if line.startswith("RRULE")]
+    if any("UNTIL=" not in rule and "COUNT=" not in rule for rule in rules):
+        return None
+    occurrences = list(_ruleset(lines))
+    if not occurrences:
+        return None
+    last = occurrences[-1] + duration
+    if _is_all_day(lines):
+        last = last.replace(tzinfo=timezone.utc)
+    return last.astimezone(timezone.utc).isoformat()
+
+
+def occurrences(lines, window_start, window_end):
+    """Instance starts of a rule set with window_start <= start < window_end (aware UTC bounds)."""
+    lines = tuple(lines)
+    bucket_start = window_start.replace(minute=0, second=0, microsecond=0)
+    bucket_end = window_end.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    key = (lines, bucket_start, bucket_end)
+    cached = _expansions.get(key)
+    if cached is None:
+        all_day = _is_all_day(lines)
+        cached = []
+        for occurrence in _ruleset(lines).xafter(_comparable(bucket_start, all_day), inc=True):
+            if occurrence >= _comparable(bucket_end, all_day) or len(cached) >= MAX_INSTANCES_PER_SERIES:
+                break
+            cached.append(occurrence)
+        _expansions.set(key, cached)
+
+    all_day = _is_all_day(lines)
+    low, high = _comparable(window_start, all_day), _comparable(window_end, all_day)
+    return [occurrence for occurrence in cached if low <= occurrence < high]
+
+
+def _as_utc(occurrence, all_day):
+    return occurrence.replace(tzinfo=timezone.utc) if all_day else occurrence.astimezone(timezone.utc)
+
+
+def instance_id(google_event_id, occurrence, all_day):
+    """Google's instance ID format: <series id>_<YYYYMMDD> or <series id>_<YYYYMMDDTHHMMSSZ>."""
+    stamp = occurrence.strftime('%Y%m%d') if all_day else occurrence.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return f"{google_event_id}_{stamp}"
+
+
+def series_id(event_identifier):
+    """The master part of an instance ID (see instance_id), or None if it is not one."""
+    base, sep, stamp = event_identifier.rpartition('_')
+    if sep and re.fullmatch(r'\d{8}(T\d{6}Z)?', stamp):
+        return base
+    return None
+
+
+def expand(master, window_start, window_end, overridden=()):
+    """Instance rows of a master row inside the window.
+
+    Instances whose original start is in `overridden` (UTC datetimes of
+    exception rows, modified or cancelled) are skipped; a modified instance
+    is a row of its own.
+    """
+    lines = tuple(master['recurrence'])
+    all_day = _is_all_day(lines)
+    duration = _parse_iso(master['end_time']) - _parse_iso(master['start_time'])
+    rows = []
+    for occurrence in occurrences(lines, window_start, window_end):
+        start = _as_utc(occurrence, all_day)
+        if start in overridden:
+            continue
+        rows.append({
+            **master,
+            "id": f"{master['id']}_{start.strftime('%Y%m%dT%H%M%SZ')}",
+            "google_event_id": instance_id(master['google_event_id'], occurrence, all_day),
+            "start_time": start.isoformat(),
+            "end_time": (start + duration).isoformat(),
+            "recurrence": None,
+            "recurring_event_id": master['google_event_id'],
+            "original_start_time": start.isoformat()
+        })
+    return rows
+
+
+def load_masters(user_id, window_start, window_end, account_ids=None, columns="*"):
+    """Master rows of a user whose series overlaps the window."""
+    query = supabase.table("events").select(columns)\
+        .eq("user_id", user_id)\
+        .not_.is_("recurrence", "null")\
+        .lt("start_time", window_end.isoformat())\
+        .or_(f"recurrence_end.is.null,recurrence_end.gte.{window_start.isoformat()}")
+    if account_ids is not None:
+        query = query.in_("account_id", account_ids)
+    return query.execute().data or []
+
+
+def overridden_starts(user_id, masters):
+    """Original starts of the masters' exception rows: {(account_id, series id): set of UTC datetimes}."""
+    overridden = {}
+    series_ids = sorted({m['google_event_id'] for m in masters})
+    for ids in chunks(series_ids):
+        resp = supabase.table("events").select("account_id, recurring_event_id, original_start_time")\
+            .eq("user_id", user_id)\
+            .in_("recurring_event_id", ids)\
+            .execute()
+        for row in resp.data or []:
+            if row.get('original_start_time'):
+                overridden.setdefault((row['account_id'], row['recurring_event_id']), set())\
+                    .add(_parse_iso(row['original_start_time']))
+    return overridden
+
+
+def load_instances(user_id, window_start, window_end, account_ids=None, columns="*"):
+    """Expanded instances of every series of a user that overlaps the window.
+
+    Exception rows themselves are not returned; readers get the modified ones
+    from their normal (non-master) events query.
+    """
+    masters = load_masters(user_id, window_start, window_end, account_ids, columns)
+    if not masters:
+        return []
+    overridden = overridden_starts(user_id, masters)
+
+    instances = []
+    for master in masters:
+        try:
+            instances.extend(expand(master, window_start, window_end,
+                                    overridden.get((master['account_id'], master['google_event_id']), ())))
+        except Exception as e:
+            print(f"Could not expand series {master.get('google_event_id')}: {e}")
+    return instances
@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+from services.cache import TTLCache
+
+# Delta mode of /reminders/upcoming (?since=<cursor>)
+# Every delta response stores a snapshot of the list it was computed from
+# ({reminder id: fingerprint}) under a new cursor. The next call diffs against
+# it and returns only added/changed reminders and removed IDs. The user's
+# change sequence is user_data_version (migrations/09, 11), which every sync,
+# settings, override and dismiss write bumps: while it and the time-based
+# validity are unchanged, a delta is answered without recomputing the list.
+# Snapshots live in this process; an unknown cursor gets the full list.
+REMINDER_CURSOR_TTL_SECONDS = int(os.getenv("REMINDER_CURSOR_TTL_SECONDS", "86400"))
+REMINDER_CURSOR_CACHE_SIZE = int(os.getenv("REMINDER_CURSOR_CACHE_SIZE", "8192"))
+
+_snapshots = TTLCache(maxsize=REMINDER_CURSOR_CACHE_SIZE, ttl=REMINDER_CURSOR_TTL_SECONDS) # cursor -> snapshot
+
+
+def fingerprint(reminder):
+    return hashlib.sha1(json.dumps(reminder, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def lookup(user_id, cursor):
+    """The snapshot a cursor stands for, or None if it is unknown, expired or another user's."""
+    snapshot = _snapshots.get(cursor) if cursor else None
+    if snapshot is None or snapshot["user_id"] != user_id:
+        return None
+    return snapshot
+
+
+def unchanged(snapshot, version):
+    """True if nothing can have changed since the snapshot: same change sequence and still valid."""
+    return version is not None and version == snapshot["version"] and time.time() < snapshot["valid_until"]
+
+
+def save(user_id, version, reminders, valid_until=None):
+    """Stores a snapshot of the reminder list and returns its cursor."""
+    cursor = uuid.uuid4().hex
+    _snapshots.set(cursor, {
+        "user_id": user_id,
+        "version": version,
+        "valid_until": valid_until if valid_until is not None else float("inf"),
+        "items": {reminder["id"]: fingerprint(reminder) for reminder in reminders}
+    })
+    return cursor
+
+
+def diff(snapshot, reminders):
+    """(added or changed reminders, removed reminder IDs) since the snapshot."""
+    previous = snapshot["items"]
+    changed = [reminder for reminder in reminders if previous.get(reminder["id"]) != fingerprint(reminder)]
+    current_ids = {reminder["id"] for reminder in reminders}
+    removed = [reminder_id for reminder_id in previous if reminder_id not in current_ids]
+    return changed, removed
@@ -0,0 +1,212 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from services import conditional
+from services.read_cache import read_cache
+
+# Server-push reminder delivery (GET /reminders/stream, Server-Sent Events)
+# While a user has an open stream, their upcoming reminders sit in one heap
+# ordered by reminder_time, and a single thread sends each one at its due time
+# instead of the app finding it on its next 60s poll. A user's reminders are
+# reloaded when their data changes and every STREAM_RELOAD_SECONDS as the 24h
+# window moves. Changes made in this process arrive as read cache
+# invalidations; changes made by other workers (syncs, webhooks) are found by
+# checking user_data_version every STREAM_VERSION_CHECK_SECONDS. Without that
+# RPC, reloads fall back to every READ_CACHE_TTL_SECONDS. Reloads and version
+# checks run on a worker pool (STREAM_LOAD_WORKERS); the dispatch thread only
+# pops due reminders, so DB latency never delays a push. Sent reminders are kept for
+# STREAM_RESUME_SECONDS, so a client that reconnects with its last event ID
+# (Last-Event-ID) gets what it missed. Per process: with several workers, each
+# serves the streams connected to it.
+STREAM_RESUME_SECONDS = int(os.getenv("STREAM_RESUME_SECONDS", "900"))
+STREAM_RELOAD_SECONDS = int(os.getenv("STREAM_RELOAD_SECONDS", "3600"))
+STREAM_VERSION_CHECK_SECONDS = int(os.getenv("STREAM_VERSION_CHECK_SECONDS", "60"))
+STREAM_LOAD_WORKERS = int(os.getenv("STREAM_LOAD_WORKERS", "4")) # Threads for reloads and version checks
+STREAM_HEARTBEAT_SECONDS = 25 # Keeps proxies from closing idle streams
+STREAM_QUEUE_SIZE = 100 # Messages buffered per connection before it is considered dead
+DUE_GRACE_SECONDS = 60 # Same window as trigger_immediately in /reminders/upcoming
+
+
+def _due(reminder):
+    return datetime.fromisoformat(reminder["reminder_time"]).timestamp()
+
+
+def event_id(due, reminder):
+    """SSE event ID, also the resume cursor: "<due epoch ms>:<reminder id>"."""
+    return f"{int(due * 1000)}:{reminder['id']}"
+
+
+def parse_cursor(cursor):
+    """(due epoch ms, reminder id) of an event ID, or None if it is malformed."""
+    due_ms, sep, reminder_id = (cursor or "").partition(":")
+    if not sep or not due_ms.isdigit():
+        return None
+    return int(due_ms), reminder_id
+
+
+class ReminderDispatcher:
+    def __init__(self):
+        self._loader = None # user_id -> list of reminders, as returned by /reminders/upcoming
+        self._heap = [] # (due, seq, user_id, generation, reminder or None for a reload)
+        self._seq = itertools.count()
+        self._users = {} # user_id -> {"subscribers", "generation", "dirty", "loading", "sent", "idle_since", "version", "checked_at"}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = None
+        read_cache.add_listener(self._on_invalidate)
+
+    def set_loader(self, loader):
+        self._loader = loader
+
+    def _ensure_thread(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=STREAM_LOAD_WORKERS, thread_name_prefix="reminder-loader")
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="reminder-dispatcher", daemon=True)
+            self._thread.start()
+
+    def subscribe(self, user_id, deliver, cursor=None):
+        """Registers deliver(message) for the user's due reminders. Returns a token for unsubscribe().
+
+        deliver must not block; it is called from the dispatcher thread.
+        Messages are {"id": event id, "reminder": {...}}. With a cursor, sent
+        reminders after it (up to STREAM_RESUME_SECONDS old) are replayed first.
+        """
+        token = object()
+        after = parse_cursor(cursor)
+        with self._cond:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = {
+                    "subscribers": {}, "generation": 0, "dirty": True, "loading": False, "sent": deque(), "idle_since": None,
+                    "version": None, "checked_at": 0
+                }
+            state["subscribers"][token] = deliver
+            state["idle_since"] = None
+            replay = [message for due, message in state["sent"]
+                      if after and (int(due * 1000), message["reminder"]["id"]) > after]
+            self._ensure_thread()
+            self._cond.notify()
+        for message in replay:
+            deliver(message)
+        return token
+
+    def unsubscribe(self, user_id, token):
+        with self._cond:
+            state = self._users.get(user_id)
+            if state:
+                state["subscribers"].pop(token, None)
+                if not state["subscribers"]:
+                    # Kept (and still fed) for a while, so a reconnect can resume
+                    state["idle_since"] = time.time()
+
+    def _on_invalidate(self, user_id, kinds):
+        if kinds is not None and "upcoming" not in kinds:
+            return
+        with self._cond:
+            state = self._users.get(user_id)
+            if state:
+                state["dirty"] = True
+                self._cond.notify()
+
+    def _check_version(self, user_id):
+        """Invalidates the user if their data version changed since the last load (writes by other workers). Pool thread."""
+        version = conditional.data_version(user_id)
+        with self._cond:
+            state = self._users.get(user_id)
+            if state is None:
+                return
+            state["checked_at"] = time.time()
+            changed = version is not None and state["version"] is not None and version != state["version"]
+        if changed:
+            # Also drops this process's cached inputs, which predate the change; the listener reloads
+            read_cache.invalidate(user_id, kinds=("upcoming",))
+
+    def _reload(self, user_id):
+        """Loads the user's reminders into the heap. Pool thread."""
+        version = conditional.data_version(user_id) # Before loading: a write during the load is seen next check
+        try:
+            reminders = self._loader(user_id).get("reminders", []) if self._loader else []
+        except Exception as e:
+            print(f"Reminder dispatcher: failed to load reminders for {user_id}: {e}")
+            reminders = None
+        now = time.time()
+        with self._cond:
+            state = self._users.get(user_id)
+            if state is None:
+                return
+            state["loading"] = False
+            self._cond.notify() # New heap entries, or dirty again meanwhile
+            state["generation"] += 1 # Heap entries of older loads are skipped when popped
+            generation = state["generation"]
+            state["version"] = version
+            state["checked_at"] = now
+            sent_ids = {message["reminder"]["id"] for _, message in state["sent"]}
+            for reminder in reminders or []:
+                due = _due(reminder)
+                if reminder["id"] in sent_ids or due <= now - DUE_GRACE_SECONDS:
+                    continue
+                heapq.heappush(self._heap, (due, next(self._seq), user_id, generation, reminder))
+            # Retry a failed load sooner than the regular reload; without versions, reload as often as the read cache expires
+            reload_in = STREAM_RELOAD_SECONDS if version is not None else read_cache.ttl
+            if reminders is None:
+                reload_in = 60
+            heapq.heappush(self._heap, (now + reload_in, next(self._seq), user_id, generation, None))
+
+    def _send(self, user_id, state, due, reminder):
+        message = {"id": event_id(due, reminder), "reminder": {**reminder, "trigger_immediately": True}}
+        state["sent"].append((due, message))
+        for deliver in list(state["subscribers"].values()):
+            try:
+                deliver(message)
+            except Exception as e:
+                print(f"Reminder dispatcher: delivery failed for {user_id}: {e}")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                # Forget users whose last stream closed more than the resume window ago
+                for user_id, state in list(self._users.items()):
+                    if state["idle_since"] and now - state["idle_since"] > STREAM_RESUME_SECONDS:
+                        del self._users[user_id]
+                    else:
+                        while state["sent"] and state["sent"][0][0] < now - STREAM_RESUME_SECONDS:
+                            state["sent"].popleft()
+                # DB work goes to the pool; a user is loaded by one task at a time
+                dirty = [user_id for user_id, state in self._users.items() if state["dirty"] and not state["loading"]]
+                for user_id in dirty:
+                    self._users[user_id]["dirty"] = False
+                    self._users[user_id]["loading"] = True
+                    self._pool.submit(self._reload, user_id)
+                for user_id, state in self._users.items():
+                    if not state["loading"] and state["version"] is not None \
+                            and now - state["checked_at"] >= STREAM_VERSION_CHECK_SECONDS:
+                        state["checked_at"] = now # Not checked again while this check runs
+                        self._pool.submit(self._check_version, user_id)
+
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, user_id, generation, reminder = heapq.heappop(self._heap)
+                    state = self._users.get(user_id)
+                    if state is None or generation != state["generation"]:
+                        continue # Stale entry of an older load, or the user is gone
+                    if reminder is None:
+                        state["dirty"] = True
+                    else:
+                        self._send(user_id, state, due, reminder)
+                if any(state["dirty"] and not state["loading"] for state in self._users.values()):
+                    continue
+                timeout = self._heap[0][0] - now if self._heap else STREAM_HEARTBEAT_SECONDS
+                checks = [state["checked_at"] + STREAM_VERSION_CHECK_SECONDS - now
+                          for state in self._users.values() if state["version"] is not None]
+                if checks:
+                    timeout = min(timeout, min(checks))
+                self._cond.wait(timeout=max(0.01, min(timeout, STREAM_HEARTBEAT_SECONDS)))
+
+
+reminder_dispatcher = ReminderDispatcher()
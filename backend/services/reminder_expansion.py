@@ -0,0 +1,52 @@
+import itertools
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError: # Optional: the plain loop below gives the same result
+    np = None
+
+# Batched events x offsets expansion
+# Callers parse each occurrence start once into epoch seconds; expand() then
+# computes every reminder time (start - minutes * 60) and the "still due"
+# filter for all of them in a few array operations, and callers build output
+# dicts only for the reminders that are kept. Shared team calendars with
+# hundreds of events and several offsets make the per-reminder Python loop
+# the hot part of a poll or a materialization.
+VECTORIZE_MIN_REMINDERS = 64 # Below this, numpy's per-call overhead outweighs the loop
+
+
+def epoch(moment):
+    """Epoch seconds (int) of an aware datetime."""
+    return int(moment.timestamp())
+
+
+def isoformat(seconds):
+    """UTC ISO string of epoch seconds, as the DB returns timestamptz values."""
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def expand(starts, offsets, after=None):
+    """Reminders of occurrences: (start index, minutes before, reminder epoch seconds) tuples.
+
+    starts are epoch seconds; offsets[i] are the minutes-before values of
+    starts[i]. With `after` (epoch seconds), only reminders later than it are
+    returned. Ordered by start index, then by offsets[i] order.
+    """
+    total = sum(len(minutes) for minutes in offsets)
+    if np is None or total < VECTORIZE_MIN_REMINDERS:
+        return [
+            (i, minutes, starts[i] - minutes * 60)
+            for i, event_offsets in enumerate(offsets)
+            for minutes in event_offsets
+            if after is None or starts[i] - minutes * 60 > after
+        ]
+
+    counts = np.fromiter((len(minutes) for minutes in offsets), dtype=np.int64, count=len(offsets))
+    index = np.repeat(np.arange(len(starts), dtype=np.int64), counts)
+    minutes = np.fromiter(itertools.chain.from_iterable(offsets), dtype=np.int64, count=total)
+    times = np.asarray(starts, dtype=np.int64)[index] - minutes * 60
+    if after is not None:
+        keep = times > after
+        index, minutes, times = index[keep], minutes[keep], times[keep]
+    return list(zip(index.tolist(), minutes.tolist(), times.tolist()))
@@ -0,0 +1,295 @@
+import os
+from datetime import datetime, timedelta, timezone
+from services.supabase_client import supabase
+from services import recurrence, reminder_expansion, settings_store
+from services.cache import TTLCache
+from services.read_cache import read_cache
+from services.postgrest import PAGE_SIZE, chunks
+
+# Materialized reminders (public.reminders, see migrations/11)
+# One row per (event, occurrence start, minutes_before) is written when events
+# sync, when an event's reminder_offsets change and when alarm_settings change,
+# so /reminders/upcoming is a range scan on (user_id, reminder_time) instead of
+# expanding events x offsets on every poll. Rows cover occurrences from
+# REMINDER_LOOKBACK ago to the user's stored horizon (users.reminders_until),
+# which readers roll forward (ensure_materialized).
+# Re-materializing never touches a row whose key still applies, so a dismissed
+# reminder stays dismissed; rows whose event moved or lost the offset are deleted.
+REMINDER_HORIZON_DAYS = int(os.getenv("REMINDER_HORIZON_DAYS", "14"))
+REMINDER_LOOKBACK = timedelta(hours=2) # Same lookback as /reminders/upcoming
+REMINDER_ROLL_MARGIN = timedelta(hours=25) # Roll the horizon before the 24h window reaches it
+REMINDER_CHUNK_SIZE = 500 # Rows per insert
+
+EVENT_COLUMNS = "id, user_id, account_id, google_event_id, start_time, end_time, reminder_offsets, recurrence, is_cancelled"
+CONFLICT_COLUMNS = "event_id, occurrence_start, minutes_before"
+
+_horizons = TTLCache(maxsize=4096, ttl=3600) # user_id -> materialized-until (aware datetime)
+_available = True # Flipped off if migration 11 is not applied
+_resync = set() # Users whose incremental refresh failed: re-materialized in full on their next read
+
+
+def available():
+    return _available
+
+
+def _missing_schema(e):
+    # Undefined column / column not in the schema cache / no matching unique index for on_conflict
+    return any(code in str(e) for code in ("42703", "PGRST204", "42P10"))
+
+
+def _disable(e):
+    global _available
+    print(f"Reminder materialization unavailable (migration 11 missing?): {e}")
+    _available = False
+
+
+def settings_offsets(user_id):
+    """The user's default reminder offsets (alarm_settings), like /reminders/upcoming reads them."""
+    return settings_store.offsets(settings_store.get(user_id))
+
+
+def _key(row):
+    return (row["event_id"], recurrence.sort_key(row["occurrence_start"]), row["minutes_before"])
+
+
+def _occurrences(event, window_start, window_end, overridden):
+    """UTC starts of an event (or of a master's instances) inside the window."""
+    if event.get("is_cancelled"):
+        return []
+    if event.get("recurrence"):
+        try:
+            instances = recurrence.expand(event, window_start, window_end,
+                                          overridden.get((event['account_id'], event['google_event_id']), ()))
+        except Exception as e:
+            print(f"Could not expand series {event.get('google_event_id')}: {e}")
+            return []
+        return [recurrence.sort_key(instance["start_time"]) for instance in instances]
+    start = recurrence.sort_key(event["start_time"])
+    return [start] if window_start <= start <= window_end else []
+
+
+def desired_rows(user_id, events, offsets, window_start, window_end, overridden):
+    """Reminder rows for the events' occurrences inside the window."""
+    occurrences, starts, occurrence_offsets = [], [], []
+    for event in events:
+        event_offsets = sorted(set(event["reminder_offsets"] if event.get("reminder_offsets") is not None else offsets))
+        for start in _occurrences(event, window_start, window_end, overridden):
+            occurrences.append((event["id"], start.isoformat()))
+            starts.append(reminder_expansion.epoch(start))
+            occurrence_offsets.append(event_offsets)
+    return [{
+        "user_id": user_id,
+        "event_id": occurrences[i][0],
+        "occurrence_start": occurrences[i][1],
+        "minutes_before": minutes,
+        "reminder_time": reminder_expansion.isoformat(reminder_seconds)
+    } for i, minutes, reminder_seconds in reminder_expansion.expand(starts, occurrence_offsets)]
+
+
+def _stored_rows(user_id, window_start, window_end, event_ids=None):
+    """Stored reminder keys -> row id, for the given events (or all of the user's) in the window."""
+    stored = {}
+    def collect(query):
+        offset = 0
+        while True:
+            rows = query.order("id").range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            for row in rows:
+                stored[_key(row)] = row["id"]
+            if len(rows) < PAGE_SIZE:
+                return
+            offset += PAGE_SIZE
+
+    def base():
+        return supabase.table("reminders").select("id, event_id, occurrence_start, minutes_before")\
+            .eq("user_id", user_id)\
+            .gte("occurrence_start", window_start.isoformat())\
+            .lte("occurrence_start", window_end.isoformat())
+    if event_ids is None:
+        collect(base())
+    else:
+        for ids in chunks(sorted(event_ids)):
+            collect(base().in_("event_id", ids))
+    return stored
+
+
+def _write(user_id, desired, stored):
+    """Inserts missing rows and deletes stale ones. Returns the number of rows changed."""
+    wanted = {_key(row): row for row in desired}
+    missing = [row for key, row in wanted.items() if key not in stored]
+    stale = [row_id for key, row_id in stored.items() if key not in wanted]
+
+    for chunk in chunks(missing, REMINDER_CHUNK_SIZE):
+        # ignore_duplicates: a concurrent writer may have inserted (or the user dismissed) it meanwhile
+        supabase.table("reminders").upsert(chunk, on_conflict=CONFLICT_COLUMNS, ignore_duplicates=True).execute()
+    for ids in chunks(stale):
+        supabase.table("reminders").delete().in_("id", ids).execute()
+
+    if missing or stale:
+        read_cache.invalidate(user_id, kinds=("upcoming",))
+    return len(missing) + len(stale)
+
+
+def _stored_horizon(user_id):
+    until = _horizons.get(user_id)
+    if until is None:
+        resp = supabase.table("users").select("reminders_until").eq("id", user_id).execute()
+        value = resp.data[0].get("reminders_until") if resp.data else None
+        until = recurrence.sort_key(value) if value else None
+        if until:
+            _horizons.set(user_id, until)
+    return until
+
+
+def materialize_user(user_id):
+    """Recomputes every reminder of a user from now - REMINDER_LOOKBACK to a new horizon."""
+    if not _available:
+        return 0
+    now = datetime.now(timezone.utc)
+    window_start = now - REMINDER_LOOKBACK
+    window_end = now + timedelta(days=REMINDER_HORIZON_DAYS)
+    try:
+        events = []
+        offset = 0
+        while True:
+            query = supabase.table("events").select(EVENT_COLUMNS)\
+                .eq("user_id", user_id)\
+                .gte("start_time", window_start.isoformat())\
+                .lte("start_time", window_end.isoformat())
+            if recurrence.SYNC_RECURRENCE_MASTERS:
+                query = query.is_("recurrence", "null") # Masters are loaded below, whatever their start
+            rows = query.order("id").range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            events.extend(rows)
+            if len(rows) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+        # Only stored when SYNC_RECURRENCE_MASTERS is on
+        masters = recurrence.load_masters(user_id, window_start, window_end, columns=EVENT_COLUMNS) \
+            if recurrence.SYNC_RECURRENCE_MASTERS else []
+        overridden = recurrence.overridden_starts(user_id, masters) if masters else {}
+
+        desired = desired_rows(user_id, events + masters, settings_offsets(user_id), window_start, window_end, overridden)
+        changed = _write(user_id, desired, _stored_rows(user_id, window_start, window_end))
+        # Reminders of occurrences that are over are never read again
+        supabase.table("reminders").delete().eq("user_id", user_id).lt("occurrence_start", window_start.isoformat()).execute()
+
+        supabase.table("users").update({"reminders_until": window_end.isoformat()}).eq("id", user_id).execute()
+        _horizons.set(user_id, window_end)
+        _resync.discard(user_id)
+        print(f"Materialized reminders for user {user_id}: {len(desired)} rows, {changed} changed")
+        return changed
+    except Exception as e:
+        if _missing_schema(e):
+            _disable(e)
+            return 0
+        raise
+
+
+def ensure_materialized(user_id):
+    """Materializes the user's reminders if that never happened, a refresh failed or the horizon is about to be reached."""
+    if not _available:
+        return
+    try:
+        until = _stored_horizon(user_id)
+    except Exception as e:
+        if _missing_schema(e):
+            _disable(e)
+            return
+        raise
+    if user_id in _resync or until is None or until < datetime.now(timezone.utc) + REMINDER_ROLL_MARGIN:
+        materialize_user(user_id)
+
+
+def covers(user_id, until):
+    """True if the user's stored reminders are complete up to `until`, so readers can use them.
+
+    False when they were never materialized, a refresh failed since, or the
+    horizon could not be read: readers then compute reminders from events.
+    """
+    if not _available or user_id in _resync:
+        return False
+    try:
+        horizon = _stored_horizon(user_id)
+    except Exception as e:
+        if _missing_schema(e):
+            _disable(e)
+        else:
+            print(f"DB Error reading reminders horizon: {e}")
+        return False
+    return horizon is not None and horizon >= until
+
+
+def mark_stale(user_id):
+    """After a failed refresh or materialization: the next read recomputes the user's reminders in full.
+
+    Clears the stored horizon, so other processes skip the stored rows too.
+    """
+    _resync.add(user_id)
+    _horizons.pop(user_id)
+    read_cache.invalidate(user_id, kinds=("upcoming",))
+    try:
+        supabase.table("users").update({"reminders_until": None}).eq("id", user_id).execute()
+    except Exception as e:
+        print(f"DB Error clearing reminders horizon of {user_id}: {e}")
+
+
+def refresh_events(user_id, events):
+    """Recomputes the reminders of the given events rows (EVENT_COLUMNS or more).
+
+    Exception rows also refresh their series master, whose instances they replace.
+    """
+    if not _available or not events:
+        return 0
+    try:
+        until = _stored_horizon(user_id)
+        if until is None:
+            # Never materialized: the first read does the whole user
+            return 0
+        window_start = datetime.now(timezone.utc) - REMINDER_LOOKBACK
+
+        events = list(events)
+        series_ids = {}
+        for event in events:
+            if event.get("recurring_event_id"):
+                series_ids.setdefault(event["account_id"], set()).add(event["recurring_event_id"])
+        for account_id, ids in series_ids.items():
+            for chunk in chunks(sorted(ids)):
+                events.extend(supabase.table("events").select(EVENT_COLUMNS)
+                              .eq("account_id", account_id)
+                              .in_("google_event_id", chunk)
+                              .execute().data or [])
+        events = list({event["id"]: event for event in events}.values())
+
+        masters = [event for event in events if event.get("recurrence")]
+        overridden = recurrence.overridden_starts(user_id, masters) if masters else {}
+        desired = desired_rows(user_id, events, settings_offsets(user_id), window_start, until, overridden)
+        stored = _stored_rows(user_id, window_start, until, event_ids={event["id"] for event in events})
+        return _write(user_id, desired, stored)
+    except Exception as e:
+        if _missing_schema(e):
+            _disable(e)
+            return 0
+        raise
+
+
+def refresh_synced(user_id, account_id, google_event_ids):
+    """refresh_events for rows the sync just wrote, looked up by google_event_id."""
+    if not _available or not google_event_ids:
+        return 0
+    events = []
+    for chunk in chunks(sorted(google_event_ids)):
+        events.extend(supabase.table("events").select(EVENT_COLUMNS + ", recurring_event_id")
+                      .eq("account_id", account_id)
+                      .in_("google_event_id", chunk)
+                      .execute().data or [])
+    return refresh_events(user_id, events)
+
+
+def dismiss(user_id, reminder_id):
+    """Marks one of the user's reminders dismissed. Returns False if it does not exist."""
+    resp = supabase.table("reminders").update({
+        "is_dismissed": True,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }).eq("id", reminder_id).eq("user_id", user_id).execute()
+    if resp.data:
+        read_cache.invalidate(user_id, kinds=("upcoming",))
+    return bool(resp.data)
@@ -0,0 +1,76 @@
+import os
+import copy
+from datetime import datetime, timezone
+from services.supabase_client import supabase
+from services.cache import TTLCache
+
+# Alarm settings with a write-through cache
+# Reads come from memory after the first one; put() writes the row and caches
+# what the DB returned. A user without a row gets the defaults, which are not
+# stored until they save settings. Every settings dict carries "version"
+# (updated_at in epoch ms, 0 for defaults) for ETags.
+# The TTL only covers writes from other processes.
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+SETTINGS_CACHE_TTL_SECONDS = int(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "3600"))
+
+DEFAULT_SETTINGS = {
+    "global_reminder_offset_minutes": 30,
+    "reminder_offsets": [30],
+    "default_alarm_sound": "default",
+    "morning_mode_enabled": False,
+    "morning_mode_sound": "default"
+}
+
+_settings = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL_SECONDS) # user_id -> settings dict
+
+
+def _version(updated_at):
+    if not updated_at:
+        return 0
+    parsed = datetime.fromisoformat(str(updated_at).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _normalize(user_id, row):
+    if not row:
+        return {"user_id": user_id, **copy.deepcopy(DEFAULT_SETTINGS), "version": 0}
+    data = dict(row)
+    # Backfill if reminder_offsets is missing from old data
+    if not data.get("reminder_offsets"):
+        data["reminder_offsets"] = [data.get("global_reminder_offset_minutes") or 30]
+    data["version"] = _version(data.get("updated_at"))
+    return data
+
+
+def get(user_id):
+    """The user's settings (defaults if none are stored). Raises on DB errors.
+
+    Returns a copy; callers may modify it.
+    """
+    cached = _settings.get(user_id)
+    if cached is None:
+        resp = supabase.table("alarm_settings").select("*").eq("user_id", user_id).execute()
+        cached = _normalize(user_id, resp.data[0] if resp.data else None)
+        _settings.set(user_id, cached)
+    return copy.deepcopy(cached)
+
+
+def put(user_id, data):
+    """Writes the user's settings and caches the stored row. Returns it (normalized)."""
+    data = {**data, "user_id": user_id, "updated_at": datetime.now(timezone.utc).isoformat()}
+    data.pop("version", None)
+    resp = supabase.table("alarm_settings").upsert(data).execute()
+    stored = _normalize(user_id, resp.data[0] if resp.data else data)
+    _settings.set(user_id, stored)
+    return copy.deepcopy(stored)
+
+
+def forget(user_id):
+    _settings.pop(user_id)
+
+
+def offsets(settings):
+    """Default reminder offsets of a settings dict."""
+    return settings.get("reminder_offsets") or [settings.get("global_reminder_offset_minutes") or 30]
@@ -0,0 +1,74 @@
+import threading
+import time
+
+# Single-flight call coalescing
+# Concurrent calls with the same key share one execution; a finished result is
+# served again for `fresh_for` seconds.
+MAX_REMEMBERED_RESULTS = 1000
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, fresh_for=0):
+        self.fresh_for = fresh_for
+        self._lock = threading.Lock()
+        self._calls = {} # key -> _Call in flight
+        self._results = {} # key -> (finished_at, result)
+
+    def do(self, key, fn):
+        """Runs fn() once per key at a time.
+
+        Returns (result, shared); shared is True when the result came from
+        another caller's execution or from the freshness window.
+        Errors are raised to every waiting caller and never cached.
+        """
+        with self._lock:
+            finished = self._results.get(key)
+            if finished and time.time() - finished[0] < self.fresh_for:
+                return finished[1], True
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                if call.error is None and self.fresh_for > 0:
+                    self._remember(key, call.result)
+            call.done.set()
+        return call.result, False
+
+    def _remember(self, key, result):
+        now = time.time()
+        if len(self._results) >= MAX_REMEMBERED_RESULTS:
+            for old_key, (finished_at, _) in list(self._results.items()):
+                if now - finished_at >= self.fresh_for:
+                    self._results.pop(old_key)
+            if len(self._results) >= MAX_REMEMBERED_RESULTS:
+                self._results.pop(next(iter(self._results)))
+        self._results[key] = (now, result)
+
+    def forget(self, predicate):
+        """Drops remembered results whose key matches, e.g. after a disconnect."""
+        with self._lock:
+            for key in [k for k in self._results if predicate(k)]:
+                self._results.pop(key)
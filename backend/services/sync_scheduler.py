@@ -0,0 +1,172 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.supabase_client import supabase
+from services import google_sync, watch_channels
+
+# Background Google sync scheduler
+# Periodically syncs every active connected account on a worker pool, so the
+# app reads already-synced events instead of waiting on Google.
+# Run it in ONE process only (e.g. a single uvicorn worker), or accounts are synced twice.
+SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "false").lower() == "true"
+SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", "300"))
+SYNC_PUSH_INTERVAL_SECONDS = int(os.getenv("SYNC_PUSH_INTERVAL_SECONDS", "3600")) # Safety-net poll for accounts with a push channel
+SYNC_JITTER_SECONDS = int(os.getenv("SYNC_JITTER_SECONDS", "60"))
+SYNC_MAX_BACKOFF_SECONDS = int(os.getenv("SYNC_MAX_BACKOFF_SECONDS", "3600"))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4")) # Caps concurrent accounts, and so outbound Google QPS
+SYNC_TICK_SECONDS = 5
+ACCOUNTS_RELOAD_SECONDS = 60
+
+
+class SyncScheduler:
+    def __init__(self, interval=SYNC_INTERVAL_SECONDS, jitter=SYNC_JITTER_SECONDS, workers=SYNC_WORKERS):
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self._accounts = {} # account_id -> connected_accounts row
+        self._state = {} # account_id -> {"next_due": epoch, "failures": int}
+        self._running = set() # account_ids queued or syncing right now
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._accounts_loaded_at = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        print(f"Sync scheduler starting (interval {self.interval}s, {self.workers} workers)")
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sync")
+        self._thread = threading.Thread(target=self._loop, name="sync-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def request_sync(self, account_ids):
+        """Moves the given accounts to the front of the queue.
+
+        An account that is syncing right now is synced once more afterwards,
+        since the running sync may have fetched before the change happened.
+        Accounts in failure backoff keep their retry time.
+        """
+        now = time.time()
+        with self._lock:
+            for account_id in account_ids:
+                state = self._state.setdefault(account_id, {"failures": 0, "next_due": now})
+                if state["failures"]:
+                    continue
+                state["next_due"] = min(state["next_due"], now)
+                if account_id in self._running:
+                    state["again"] = True
+            unknown = any(account_id not in self._accounts for account_id in account_ids)
+        if unknown:
+            self._accounts_loaded_at = 0 # Pick up accounts linked since the last reload
+        self._wake.set()
+
+    def is_syncing(self, account_ids):
+        """True if any of the accounts is syncing, or due and about to be picked up."""
+        now = time.time()
+        with self._lock:
+            return any(
+                account_id in self._running
+                or (account_id in self._state and self._state[account_id]["next_due"] <= now)
+                for account_id in account_ids
+            )
+
+    def _next_due(self, failures, pushed=False):
+        # Accounts with a push channel are synced by /calendar/webhook; polling is only a fallback
+        delay = SYNC_PUSH_INTERVAL_SECONDS if pushed else self.interval
+        if failures:
+            # Exponential backoff for accounts that keep failing (revoked tokens, quota...)
+            delay = min(SYNC_MAX_BACKOFF_SECONDS, self.interval * (2 ** failures))
+        return time.time() + delay + random.uniform(0, self.jitter)
+
+    def _reload_accounts(self):
+        try:
+            resp = supabase.table("connected_accounts").select("*").eq("is_active", True).execute()
+        except Exception as e:
+            print(f"Sync scheduler: failed to load accounts: {e}")
+            return
+        accounts = {acc['id']: acc for acc in resp.data or []}
+        with self._lock:
+            self._accounts = accounts
+            for account_id in accounts:
+                # Spread the first round over one interval instead of syncing everything at once
+                self._state.setdefault(account_id, {"failures": 0, "next_due": time.time() + random.uniform(0, self.interval)})
+            for account_id in list(self._state):
+                if account_id not in accounts:
+                    self._state.pop(account_id)
+        self._accounts_loaded_at = time.time()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if time.time() - self._accounts_loaded_at >= ACCOUNTS_RELOAD_SECONDS:
+                self._reload_accounts()
+
+            now = time.time()
+            with self._lock:
+                due = [
+                    self._accounts[account_id] for account_id, state in self._state.items()
+                    if state["next_due"] <= now and account_id not in self._running and account_id in self._accounts
+                ]
+                for account in due:
+                    self._running.add(account['id'])
+
+            for account in due:
+                self._pool.submit(self._run, account)
+
+            self._wake.wait(SYNC_TICK_SECONDS)
+            self._wake.clear()
+
+    def _run(self, account):
+        account_id = account['id']
+        ok = False
+        pushed = False
+        try:
+            # Always start from the latest row so a sync token stored by another sync is used
+            fresh = supabase.table("connected_accounts").select("*").eq("id", account_id).eq("is_active", True).execute()
+            if fresh.data:
+                result = google_sync.sync_account(fresh.data[0])
+                ok = account.get('email') in result["sync_modes"] and not result["upsert_error"]
+                pushed = self._ensure_channel(fresh.data[0])
+            else:
+                ok = True # Disconnected meanwhile; dropped on next reload
+        except Exception as e:
+            print(f"Sync scheduler: account {account_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(account_id)
+                state = self._state.get(account_id)
+                if state is not None:
+                    state["failures"] = 0 if ok else state["failures"] + 1
+                    state["next_due"] = self._next_due(state["failures"], pushed)
+                    if state.pop("again", False):
+                        state["next_due"] = time.time()
+                        self._wake.set()
+
+    def _ensure_channel(self, account):
+        """Opens or renews the account's push channel. Returns True if it has one."""
+        try:
+            return watch_channels.ensure_channel(account)
+        except Exception as e:
+            print(f"Sync scheduler: watch channel for account {account['id']} failed: {e}")
+            return False
+
+
+scheduler = SyncScheduler()
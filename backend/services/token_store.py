@@ -0,0 +1,151 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from services.supabase_client import supabase
+from services import http_client
+
+# In-process Google access token cache (keyed by connected_accounts.id)
+# Tokens are refreshed ahead of token_expires_at, one refresh per account at a time.
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID") or os.getenv("EXPO_PUBLIC_GOOGLE_WEB_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+TOKEN_REFRESH_MARGIN = timedelta(seconds=int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300")))
+
+_tokens = {} # account_id -> {"access_token": str, "expires_at": datetime or None (unknown)}
+_refresh_locks = {} # account_id -> Lock, so only one refresh per account is in flight
+_registry_lock = threading.Lock()
+
+
+def parse_expiry(value):
+    """Parses token_expires_at from the DB (ISO string) into an aware datetime."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def expiry_from(expires_in):
+    """Turns Google's expires_in (seconds) into an absolute expiry time."""
+    if not expires_in:
+        return None
+    return datetime.now(timezone.utc) + timedelta(seconds=int(expires_in))
+
+
+def _is_fresh(entry):
+    # Unknown expiry (e.g. a session token from the app) is used until Google answers 401
+    if not entry or not entry.get("access_token"):
+        return False
+    expires_at = entry.get("expires_at")
+    return expires_at is None or expires_at - TOKEN_REFRESH_MARGIN > datetime.now(timezone.utc)
+
+
+def _refresh_lock(account_id):
+    with _registry_lock:
+        return _refresh_locks.setdefault(account_id, threading.Lock())
+
+
+def remember(account_id, access_token, expires_at=None):
+    if account_id and access_token:
+        with _registry_lock:
+            _tokens[account_id] = {"access_token": access_token, "expires_at": expires_at}
+
+
+def forget(account_id):
+    with _registry_lock:
+        _tokens.pop(account_id, None)
+        _refresh_locks.pop(account_id, None)
+
+
+def adopt_session_token(account_id, session_token):
+    """Picks the token to use for an account that also arrived as the app's session token.
+
+    A cached token with a known, still valid expiry wins (we refreshed it ourselves).
+    Otherwise the session token is adopted with unknown expiry.
+    Returns (token, changed); changed means the DB copy should be updated.
+    """
+    with _registry_lock:
+        entry = _tokens.get(account_id)
+    if entry and entry.get("expires_at") and _is_fresh(entry):
+        return entry["access_token"], False
+    if entry and entry.get("access_token") == session_token:
+        return session_token, False
+    remember(account_id, session_token)
+    return session_token, True
+
+
+def get_access_token(source):
+    """Returns a usable access token for a sync source, refreshing it if it is about to expire.
+
+    `source` is a sync source dict (id, email, token, refresh_token, token_expires_at).
+    After the first call the DB values are only used to seed the cache.
+    """
+    account_id = source.get("id")
+    with _registry_lock:
+        entry = _tokens.get(account_id)
+    if entry is None:
+        entry = {"access_token": source.get("token"), "expires_at": parse_expiry(source.get("token_expires_at"))}
+        remember(account_id, entry["access_token"], entry["expires_at"])
+
+    if _is_fresh(entry):
+        return entry["access_token"]
+
+    print(f"[{source.get('email')}] Token expires soon. Refreshing proactively...")
+    return refresh(source, stale_token=entry.get("access_token")) or entry.get("access_token")
+
+
+def refresh(source, stale_token=None):
+    """Uses refresh_token to get a new access_token and updates cache and DB.
+
+    Single-flight per account: callers that waited on the lock reuse the token
+    the first caller fetched instead of refreshing again.
+    """
+    account_id = source.get("id")
+    refresh_token = source.get("refresh_token")
+    if not refresh_token:
+        print(f"[{source.get('email')}] No refresh token available.")
+        return None
+
+    with _refresh_lock(account_id):
+        with _registry_lock:
+            entry = _tokens.get(account_id)
+        if entry and entry.get("access_token") != stale_token and _is_fresh(entry):
+            return entry["access_token"]
+
+        data = {
+            "client_id": GOOGLE_CLIENT_ID,
+            "client_secret": GOOGLE_CLIENT_SECRET,
+            "refresh_token": refresh_token,
+            "grant_type": "refresh_token"
+        }
+        try:
+            print(f"Refreshing token for {source.get('email')}...")
+            resp = http_client.post(TOKEN_URL, data=data)
+            if resp.status_code != 200:
+                print(f"[{source.get('email')}] Refresh failed: {resp.text}")
+                return None
+
+            new_tokens = resp.json()
+            new_access = new_tokens.get('access_token')
+            expires_at = expiry_from(new_tokens.get('expires_in'))
+            remember(account_id, new_access, expires_at)
+            print(f"[{source.get('email')}] Token refreshed successfully.")
+        except Exception as e:
+            print(f"Error refreshing token: {e}")
+            return None
+
+        if account_id:
+            try:
+                supabase.table('connected_accounts').update({
+                    'access_token': new_access,
+                    'token_expires_at': expires_at.isoformat() if expires_at else None,
+                    'updated_at': datetime.utcnow().isoformat()
+                }).eq('id', account_id).execute()
+            except Exception as e:
+                print(f"[{source.get('email')}] Failed to store refreshed token: {e}")
+
+        return new_access
@@ -0,0 +1,183 @@
+import os
+import uuid
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+from services.supabase_client import supabase
+from services import http_client, token_store, google_sync
+
+# Google Calendar push channels (events.watch)
+# Google POSTs to GOOGLE_WEBHOOK_URL (/calendar/webhook) whenever an account's
+# primary calendar changes, so the account can be synced on change instead of polled.
+# Disabled unless GOOGLE_WEBHOOK_URL is set (it must be a public HTTPS URL).
+GOOGLE_WEBHOOK_URL = os.getenv("GOOGLE_WEBHOOK_URL")
+WATCH_TTL_SECONDS = int(os.getenv("WATCH_TTL_SECONDS", "604800")) # Requested lifetime; Google may shorten it
+WATCH_RENEW_MARGIN_SECONDS = int(os.getenv("WATCH_RENEW_MARGIN_SECONDS", "86400")) # Renew a day before expiry
+
+GOOGLE_WATCH_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events/watch"
+GOOGLE_STOP_URL = "https://www.googleapis.com/calendar/v3/channels/stop"
+
+_pending = {} # account_id -> True if another notification arrived during its sync
+_pending_lock = threading.Lock()
+
+CLEARED_COLUMNS = {
+    "watch_channel_id": None,
+    "watch_resource_id": None,
+    "watch_token": None,
+    "watch_expires_at": None
+}
+
+
+def enabled():
+    return bool(GOOGLE_WEBHOOK_URL)
+
+
+def _source(account):
+    return {
+        'id': account.get('id'),
+        'email': account.get('email'),
+        'token': account.get('access_token'),
+        'refresh_token': account.get('refresh_token'),
+        'token_expires_at': account.get('token_expires_at')
+    }
+
+
+def _post(account, url, body, retry=True):
+    """POSTs to Google as the account, refreshing the access token once on 401."""
+    source = _source(account)
+    token = token_store.get_access_token(source)
+    response = http_client.post(url, headers={'Authorization': f'Bearer {token}'}, json=body, retry=retry)
+    if response.status_code == 401 and source.get('refresh_token'):
+        token = token_store.refresh(source, stale_token=token)
+        if token:
+            response = http_client.post(url, headers={'Authorization': f'Bearer {token}'}, json=body, retry=retry)
+    return response
+
+
+def create_channel(account):
+    """Opens a new push channel for the account and stores it. Returns the stored columns or None."""
+    channel = {
+        "watch_channel_id": str(uuid.uuid4()),
+        "watch_token": secrets.token_urlsafe(24)
+    }
+    response = _post(account, GOOGLE_WATCH_URL, {
+        "id": channel["watch_channel_id"],
+        "type": "web_hook",
+        "address": GOOGLE_WEBHOOK_URL,
+        "token": channel["watch_token"],
+        "params": {"ttl": str(WATCH_TTL_SECONDS)}
+    }, retry=False) # A retried watch would open a second channel that is never stopped
+    if response.status_code != 200:
+        print(f"[{account.get('email')}] Failed to open watch channel: {response.status_code} {response.text}")
+        return None
+
+    data = response.json()
+    channel["watch_resource_id"] = data.get("resourceId")
+    expiration = data.get("expiration") # Epoch milliseconds, as a string
+    channel["watch_expires_at"] = (
+        datetime.fromtimestamp(int(expiration) / 1000, tz=timezone.utc).isoformat() if expiration else None
+    )
+    supabase.table("connected_accounts").update(channel).eq("id", account['id']).execute()
+    print(f"[{account.get('email')}] Watch channel {channel['watch_channel_id']} open until {channel['watch_expires_at']}")
+    return channel
+
+
+def stop_channel(account, clear=True):
+    """Stops the account's push channel at Google (best effort) and clears the stored columns."""
+    if account.get('watch_channel_id') and account.get('watch_resource_id'):
+        try:
+            response = _post(account, GOOGLE_STOP_URL, {
+                "id": account['watch_channel_id'],
+                "resourceId": account['watch_resource_id']
+            })
+            # 404: Google already dropped the channel (expired or stopped)
+            if response.status_code not in (200, 204, 404):
+                print(f"[{account.get('email')}] Failed to stop watch channel: {response.status_code} {response.text}")
+        except Exception as e:
+            print(f"[{account.get('email')}] Error stopping watch channel: {e}")
+    if clear:
+        supabase.table("connected_accounts").update(CLEARED_COLUMNS).eq("id", account['id']).execute()
+
+
+def needs_renewal(account):
+    expires_at = token_store.parse_expiry(account.get('watch_expires_at'))
+    if not account.get('watch_channel_id') or not expires_at:
+        return True
+    return expires_at - datetime.now(timezone.utc) <= timedelta(seconds=WATCH_RENEW_MARGIN_SECONDS)
+
+
+def ensure_channel(account):
+    """Makes sure an active account has a push channel that is not about to expire.
+
+    The replacement is opened before the old channel is stopped, so no change
+    notification is lost in between. Returns True if the account has a live channel.
+    """
+    if not enabled() or not account.get('is_active', True):
+        return False
+    if not needs_renewal(account):
+        return True
+    previous = dict(account)
+    channel = create_channel(account)
+    if channel and previous.get('watch_channel_id'):
+        stop_channel(previous, clear=False) # The new channel's columns are already stored
+    return channel is not None
+
+
+def ensure_channels(account_ids):
+    """ensure_channel for accounts synced outside the scheduler (app requests, push syncs). Never raises.
+
+    Without this, channels would only be renewed while the scheduler runs.
+    """
+    if not enabled() or not account_ids:
+        return
+    try:
+        accounts = supabase.table("connected_accounts").select("*")\
+            .in_("id", list(account_ids))\
+            .eq("is_active", True)\
+            .execute().data or []
+    except Exception as e:
+        print(f"Failed to load accounts for watch channels: {e}")
+        return
+    for account in accounts:
+        try:
+            ensure_channel(account)
+        except Exception as e:
+            print(f"[{account.get('email')}] Watch channel renewal failed: {e}")
+
+
+def find_account(channel_id):
+    """Returns the connected_accounts row that owns a channel, or None."""
+    resp = supabase.table("connected_accounts").select("*").eq("watch_channel_id", channel_id).execute()
+    return resp.data[0] if resp.data else None
+
+
+def sync_changed_account(account_id):
+    """Incremental sync for one account after a push notification (no scheduler running).
+
+    Notifications come in bursts: one sync runs per account at a time, and a
+    notification that arrives during it causes exactly one more run afterwards.
+    """
+    with _pending_lock:
+        if account_id in _pending:
+            _pending[account_id] = True
+            return
+        _pending[account_id] = False
+
+    try:
+        while True:
+            fresh = supabase.table("connected_accounts").select("*").eq("id", account_id).eq("is_active", True).execute()
+            if fresh.data:
+                google_sync.sync_account(fresh.data[0])
+                try:
+                    ensure_channel(fresh.data[0]) # Renewed here too when the scheduler is off
+                except Exception as e:
+                    print(f"[{fresh.data[0].get('email')}] Watch channel renewal failed: {e}")
+            with _pending_lock:
+                if not _pending.get(account_id):
+                    _pending.pop(account_id, None)
+                    return
+                _pending[account_id] = False
+    except Exception as e:
+        print(f"Push sync for account {account_id} failed: {e}")
+        with _pending_lock:
+            _pending.pop(account_id, None)
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import uuid
+import secrets
+import requests
+
+# Local stand-in for Google push notifications.
+# Posts fake events.watch notifications to a running backend's /calendar/webhook.
+# Usage: python simulate_google_push.py <account email> [--install] [--count N] [--url http://localhost:8000]
+#   --install  gives the account a fake channel first, so no GOOGLE_WEBHOOK_URL / public URL is needed.
+#              The scheduler replaces it with a real channel once GOOGLE_WEBHOOK_URL is configured.
+
+# Load .env manually
+env_path = os.path.join(os.path.dirname(__file__), '.env')
+if os.path.exists(env_path):
+    with open(env_path, 'r') as f:
+        for line in f:
+            if '=' in line and not line.startswith('#'):
+                key, val = line.strip().split('=', 1)
+                os.environ[key] = val
+
+from services.supabase_client import supabase
+
+
+def _arg(name, default):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+def install_fake_channel(account):
+    channel = {
+        "watch_channel_id": f"local-{uuid.uuid4()}",
+        "watch_resource_id": f"local-resource-{uuid.uuid4()}",
+        "watch_token": secrets.token_urlsafe(24),
+        "watch_expires_at": None # Treated as expired, so a real scheduler renews it
+    }
+    supabase.table("connected_accounts").update(channel).eq("id", account['id']).execute()
+    print(f"Installed fake channel {channel['watch_channel_id']}")
+    return {**account, **channel}
+
+
+def post_notification(base_url, account, state, number):
+    headers = {
+        "X-Goog-Channel-ID": account['watch_channel_id'],
+        "X-Goog-Channel-Token": account['watch_token'] or "",
+        "X-Goog-Resource-ID": account['watch_resource_id'] or "",
+        "X-Goog-Resource-State": state,
+        "X-Goog-Message-Number": str(number)
+    }
+    resp = requests.post(f"{base_url}/calendar/webhook", headers=headers)
+    print(f"#{number} {state}: {resp.status_code} {resp.text}")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1].startswith("--"):
+        print("Usage: python simulate_google_push.py <account email> [--install] [--count N] [--url http://localhost:8000]")
+        sys.exit(1)
+
+    email = sys.argv[1].lower()
+    base_url = _arg("--url", "http://localhost:8000").rstrip("/")
+    count = int(_arg("--count", "1"))
+
+    resp = supabase.table("connected_accounts").select("*").eq("email", email).eq("is_active", True).execute()
+    if not resp.data:
+        print(f"No active account for {email}")
+        sys.exit(1)
+    account = resp.data[0]
+
+    if "--install" in sys.argv or not account.get('watch_channel_id'):
+        account = install_fake_channel(account)
+
+    # Google opens every channel with a "sync" message, then sends "exists" per change
+    post_notification(base_url, account, "sync", 1)
+    for i in range(count):
+        post_notification(base_url, account, "exists", i + 2)
+        time.sleep(0.1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ create table public.users (
   email text,
   full_name text,
   avatar_url text,
+  reminders_until timestamptz, -- Reminders are materialized up to here, see migrations/11
   created_at timestamptz default now()
 );
 
@@ -45,6 +46,11 @@ create table public.connected_accounts (
   access_token text, -- Consider encryption in production
   refresh_token text, -- Consider encryption in production
   token_expires_at timestamptz,
+  sync_token text, -- Google nextSyncToken for incremental sync
+  watch_channel_id text, -- Google push channel (events.watch), see migrations/07
+  watch_resource_id text,
+  watch_token text,
+  watch_expires_at timestamptz,
   created_at timestamptz default now(),
   updated_at timestamptz default now()
 );
@@ -82,6 +88,12 @@ create table public.events (
   location text,
   html_link text,
   meeting_link text,
+  content_hash text, -- Hash of synced columns, used to skip unchanged rows
+  recurrence text[], -- Series master rule lines (DTSTART first), see migrations/08
+  recurrence_end timestamptz, -- End of the last instance, NULL if endless
+  recurring_event_id text, -- Exception rows: google_event_id of the master
+  original_start_time timestamptz,
+  is_cancelled boolean not null default false,
   created_at timestamptz default now(),
   updated_at timestamptz default now(),
   unique(account_id, google_event_id)
@@ -114,7 +126,11 @@ create table public.reminders (
   reminder_time timestamptz not null,
   type text default 'notification', -- 'notification', 'alarm', 'morning_mode'
   is_dismissed boolean default false,
-  created_at timestamptz default now()
+  occurrence_start timestamptz, -- Start of the (instance of the) event, see migrations/11
+  minutes_before int,
+  created_at timestamptz default now(),
+  updated_at timestamptz default now(),
+  unique(event_id, occurrence_start, minutes_before)
 );
 
 alter table public.reminders enable row level security;
@@ -10,6 +10,7 @@ interface Alarm {
     body: string;
     account_email: string; // The email associated with the event
     event_id?: string;
+    reminder_id?: string; // Stored reminder, dismissed on the backend when stopped
     sound?: string;
     trigger_time: number;
     event_start_time?: number; // Actual event start time
@@ -35,6 +36,8 @@ export const AlarmProvider: React.FC<{ children: React.ReactNode }> = ({ childre
     const [isPlaying, setIsPlaying] = useState(false);
     const isLoadingAudio = useRef(false);
     const processedIds = useRef(new Set<string>());
+    const remindersEtag = useRef<string | null>(null);
+    const streamConnected = useRef(false);
 
     // Derived state
     const currentAlarm = alarmQueue.length > 0 ? alarmQueue[0] : null;
@@ -63,16 +66,59 @@ export const AlarmProvider: React.FC<{ children: React.ReactNode }> = ({ childre
 
     // ...
 
-    // Poll for reminders every 30s
+    // Server push: the backend sends each reminder at its due time (Server-Sent Events).
+    // EventSource reconnects by itself and resumes via Last-Event-ID. Not available on
+    // every platform; polling below covers those and any time the stream is down.
+    useEffect(() => {
+        if (typeof EventSource === 'undefined') return;
+        let source: EventSource | null = null;
+        let closed = false;
+
+        import('../services/supabase').then(m => m.supabase.auth.getSession()).then(({ data: { session } }) => {
+            if (closed || !session?.user) return;
+            source = new EventSource(`${getBackendUrl()}/reminders/stream?user_id=${session.user.id}`);
+            source.onopen = () => { streamConnected.current = true; };
+            source.onerror = () => { streamConnected.current = false; };
+            source.addEventListener('reminder', (event: MessageEvent) => {
+                const r = JSON.parse(event.data);
+                triggerAlarm({
+                    id: r.id,
+                    title: r.title,
+                    body: `Event starts at ${new Date(r.start_time).toLocaleTimeString()}`,
+                    account_email: r.account_email,
+                    event_id: r.event_id,
+                    reminder_id: r.reminder_id,
+                    sound: r.sound,
+                    trigger_time: Date.now(),
+                    event_start_time: new Date(r.start_time).getTime(),
+                    meeting_link: r.meeting_link
+                });
+            });
+        });
+
+        return () => {
+            closed = true;
+            streamConnected.current = false;
+            source?.close();
+        };
+    }, []);
+
+    // Poll for reminders every 60s (fallback while the stream is not connected)
     useEffect(() => {
         const pollReminders = async () => {
+            if (streamConnected.current) return;
             try {
                 // Get current user
                 const { data: { session } } = await import('../services/supabase').then(m => m.supabase.auth.getSession());
                 if (!session?.user) return;
 
                 const backendUrl = getBackendUrl();
-                const response = await fetch(`${backendUrl}/reminders/upcoming?user_id=${session.user.id}`);
+                // Send the last ETag: 304 means nothing changed and no reminder became due
+                const headers: Record<string, string> = {};
+                if (remindersEtag.current) headers['If-None-Match'] = remindersEtag.current;
+                const response = await fetch(`${backendUrl}/reminders/upcoming?user_id=${session.user.id}`, { headers });
+                if (response.status === 304) return;
+                remindersEtag.current = response.headers.get('ETag');
                 const data = await response.json();
 
                 if (data.reminders) {
@@ -87,6 +133,7 @@ export const AlarmProvider: React.FC<{ children: React.ReactNode }> = ({ childre
                                 body: `Event starts at ${new Date(r.start_time).toLocaleTimeString()}`,
                                 account_email: r.account_email,
                                 event_id: r.event_id,
+                                reminder_id: r.reminder_id,
                                 sound: r.sound,
                                 trigger_time: Date.now(),
                                 event_start_time: new Date(r.start_time).getTime(),
@@ -169,12 +216,27 @@ export const AlarmProvider: React.FC<{ children: React.ReactNode }> = ({ childre
         });
     };
 
+    // Dismissed reminders are not sent again, also after an app restart
+    const dismissOnBackend = async (reminderId: string) => {
+        try {
+            const { data: { session } } = await import('../services/supabase').then(m => m.supabase.auth.getSession());
+            if (!session?.user) return;
+            const backendUrl = getBackendUrl();
+            await fetch(`${backendUrl}/reminders/dismiss/${reminderId}?user_id=${session.user.id}`, { method: 'POST' });
+        } catch (error) {
+            console.error("Dismiss Error:", error);
+        }
+    };
+
     const stopAlarm = () => {
         // Mark current as processed
         if (alarmQueue.length > 0) {
             const current = alarmQueue[0];
             processedIds.current.add(current.id);
             console.log(`Alarm stopped and marked processed: ${current.id}`);
+            if (current.reminder_id) {
+                dismissOnBackend(current.reminder_id);
+            }
         }
 
         // Remove current alarm (index 0)
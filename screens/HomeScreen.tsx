@@ -54,15 +54,26 @@ export default function HomeScreen() {
 
             // 2. FETCH FROM DB (Stable Source)
             addLog("Fetching events from DB...");
-            const dbResponse = await fetch(`${backendUrl}/calendar/events?user_id=${currentSession.user.id}`);
-
-            if (dbResponse.ok) {
+            // Paged by the backend; follow next_cursor until the last page
+            const allEvents: any[] = [];
+            let cursor: string | null = null;
+            let failed = false;
+            do {
+                const cursorParam: string = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+                const dbResponse = await fetch(`${backendUrl}/calendar/events?user_id=${currentSession.user.id}${cursorParam}`);
+                if (!dbResponse.ok) {
+                    addLog(`DB Fetch Error: ${dbResponse.status}`);
+                    failed = true;
+                    break;
+                }
                 const data = await dbResponse.json();
-                const allEvents = data.events || [];
+                allEvents.push(...(data.events || []));
+                cursor = data.next_cursor || null;
+            } while (cursor);
+
+            if (!failed) {
                 setEvents(allEvents);
                 addLog(`Loaded ${allEvents.length} events from DB.`);
-            } else {
-                addLog(`DB Fetch Error: ${dbResponse.status}`);
             }
 
         } catch (error: any) {
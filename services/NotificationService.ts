@@ -90,14 +90,43 @@ export async function scheduleNotification(title: string, body: string, triggerD
     }
 }
 
+// Delta sync state: the backend only sends what changed since reminderCursor
+let reminderCursor: string | null = null;
+let cursorUserId: string | null = null;
+const knownReminders = new Map<string, any>();
+
 export async function syncReminders(userId: string, backendUrl: string) {
     try {
-        // 1. Fetch upcoming reminders from backend
-        const response = await fetch(`${backendUrl}/reminders/upcoming?user_id=${userId}`);
+        if (cursorUserId !== userId) {
+            reminderCursor = null;
+            knownReminders.clear();
+            cursorUserId = userId;
+        }
+
+        // 1. Fetch what changed since the last sync (everything on the first call)
+        const since = encodeURIComponent(reminderCursor || '');
+        const response = await fetch(`${backendUrl}/reminders/upcoming?user_id=${userId}&since=${since}`);
         const data = await response.json();
-        const reminders = data.reminders || [];
+        if (data.error) return Array.from(knownReminders.values());
+
+        const removed: string[] = data.removed || [];
+        if (data.full) knownReminders.clear();
+        for (const reminder of data.reminders || []) knownReminders.set(reminder.id, reminder);
+        for (const id of removed) {
+            knownReminders.delete(id);
+            const timer = activeTimers.get(id);
+            if (timer?.timerId) clearTimeout(timer.timerId);
+            activeTimers.delete(id);
+        }
+        reminderCursor = data.cursor || null;
+
+        const reminders = Array.from(knownReminders.values());
+        if (!data.full && (data.reminders || []).length === 0 && removed.length === 0) return reminders;
 
-        if (reminders.length === 0) return;
+        if (reminders.length === 0) {
+            if (Platform.OS !== 'web') await Notifications.cancelAllScheduledNotificationsAsync();
+            return reminders;
+        }
 
         // 2. Cancel all existing (only on mobile)
         if (Platform.OS !== 'web') {
@@ -35,6 +35,27 @@ export const updateEventSettings = async (eventId: string, offsets: number[], us
     }
 };
 
+// Many events in one request, e.g. muting every event of an account (offsets: [])
+export const updateEventSettingsBatch = async (items: { event_id: string; reminder_offsets: number[] }[], userId: string) => {
+    try {
+        const response = await fetch(`${getBackendUrl()}/reminders/events?user_id=${userId}`, {
+            method: 'PUT',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ items }),
+        });
+
+        if (!response.ok) {
+            throw new Error(`Failed to update settings: ${response.status}`);
+        }
+        return await response.json();
+    } catch (error) {
+        console.error("Error updating event settings:", error);
+        return null;
+    }
+};
+
 export const getSettings = async (userId: string) => {
     try {
         const response = await fetch(`${getBackendUrl()}/reminders/settings?user_id=${userId}`);